@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2011 by Alessandro Presta
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE
+
+
+'''
+Usage: bench.py [-s <sizes>] [-l <document size>] [-b <benchmarks>]
+                [-r <rater>] [-d <dictionary>] [-o <output file>]
+
+Times the stages of the tagging pipeline and the construction of a
+dictionary, printing one JSON object per benchmark and corpus (with
+documents and tokens per second, latency percentiles in seconds and peak
+memory in KB).
+
+  -s  comma-separated sizes of synthetic corpora (e.g. 100K,10M,200M), built
+      from sentences of the sample documents; 'tests' (the default) uses
+      the sample documents themselves
+  -l  size of each synthetic document (defaults to 4K)
+  -b  comma-separated benchmarks among reader, stemmer, rater, tagger and
+      build_dict (defaults to all)
+  -r  name of the rater class, from the tagger or extras module (defaults to
+      Rater)
+  -d  dictionary, pickled or in the compact format (defaults to
+      data/dict.pkl)
+  -o  file where the results are appended (defaults to the standard output)
+'''
+
+import glob
+import json
+import random
+import resource
+import time
+
+from tagger import *
+import extras
+
+
+BENCHMARKS = ['reader', 'stemmer', 'rater', 'tagger', 'build_dict']
+
+
+def sample_documents():
+    '''
+    @returns: the list of the sample documents in the tests directory
+    '''
+
+    documents = []
+    for filename in sorted(glob.glob('tests/*')):
+        with open(filename, 'r') as f:
+            documents.append(f.read())
+    return documents
+
+
+def synthetic_corpus(size, document_size=4096, seed=0):
+    '''
+    @param size:          total size of the corpus in bytes
+    @param document_size: size of each document in bytes
+    @param seed:          seed of the random choice of sentences
+
+    @returns: a list of documents made of randomly chosen sentences of the
+              sample documents
+    '''
+
+    sentences = [s.strip() + '.' for doc in sample_documents()
+                 for s in doc.split('.') if s.strip()]
+    rng = random.Random(seed)
+
+    documents = []
+    total = 0
+    while total < size:
+        parts = []
+        length = 0
+        while length < min(document_size, size - total):
+            sentence = rng.choice(sentences)
+            parts.append(sentence)
+            length += len(sentence) + 1
+        documents.append(' '.join(parts))
+        total += length
+    return documents
+
+
+def parse_size(size):
+    '''
+    @param size: a size in bytes, with an optional K, M or G suffix
+
+    @returns: the size in bytes
+    '''
+
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    size = size.strip().upper()
+    if size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def percentiles(latencies, points=(50, 90, 99)):
+    '''
+    @param latencies: a list of durations in seconds
+    @param points:    the percentiles to be computed
+
+    @returns: a dictionary of percentiles (nearest rank)
+    '''
+
+    latencies = sorted(latencies)
+    result = {}
+    for p in points:
+        rank = max(0, int(round(p / 100.0 * len(latencies))) - 1)
+        result['p%d' % p] = latencies[rank] if latencies else 0.0
+    return result
+
+
+def time_each(function, inputs):
+    '''
+    @param function: the function to be timed
+    @param inputs:   a list of arguments for the function
+
+    @returns: the list of results and the list of durations of each call
+    '''
+
+    results = []
+    latencies = []
+    for x in inputs:
+        start = time.time()
+        results.append(function(x))
+        latencies.append(time.time() - start)
+    return results, latencies
+
+
+def run_benchmark(name, documents, weights, rater_class):
+    '''
+    @param name:        the name of the benchmark
+    @param documents:   the list of documents to process
+    @param weights:     the dictionary of weights
+    @param rater_class: the L{Rater} class to be used
+
+    @returns: a dictionary with the measurements
+    '''
+
+    reader = Reader()
+    stemmer = Stemmer()
+    rater = rater_class(weights)
+
+    if name == 'build_dict':
+        import StringIO
+        import build_dict
+
+        files = [StringIO.StringIO(doc) for doc in documents]
+        start = time.time()
+        build_dict.build_dict_from_files(StringIO.StringIO(), files)
+        latencies = [time.time() - start]
+        tokens = sum(len(extras.SimpleReader()(doc)) for doc in documents)
+        docs_number = len(documents)
+        return measurements(docs_number, tokens, latencies)
+
+    if name == 'reader':
+        results, latencies = time_each(reader, documents)
+    elif name == 'stemmer':
+        tags = map(reader, documents)
+        results, latencies = time_each(lambda t: map(stemmer, t), tags)
+    elif name == 'rater':
+        tags = [map(stemmer, reader(doc)) for doc in documents]
+        results, latencies = time_each(rater, tags)
+        results = tags
+    elif name == 'tagger':
+        tagger = Tagger(reader, stemmer, rater)
+        results, latencies = time_each(tagger, documents)
+        results = map(reader, documents)
+    else:
+        raise ValueError('unknown benchmark: %s' % name)
+
+    return measurements(len(documents), sum(map(len, results)), latencies)
+
+
+def measurements(docs_number, tokens, latencies):
+    '''
+    @param docs_number: number of documents processed
+    @param tokens:      number of tokens processed
+    @param latencies:   list of durations of the timed calls
+
+    @returns: a dictionary with throughputs and latency percentiles
+    '''
+
+    total = sum(latencies) or float('inf')
+    result = {'documents': docs_number, 'tokens': tokens,
+              'seconds': sum(latencies),
+              'docs_per_sec': docs_number / total,
+              'tokens_per_sec': tokens / total}
+    result.update(percentiles(latencies))
+    return result
+
+
+def _run_in_child(queue, name, documents, weights, rater_class):
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result = run_benchmark(name, documents, weights, rater_class)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result['peak_rss_kb'] = peak
+    result['peak_rss_growth_kb'] = peak - rss_start
+    queue.put(result)
+
+
+def isolated(name, documents, weights, rater_class):
+    '''
+    Runs a benchmark in a new process, so that its peak memory is measured
+    separately from the other ones
+
+    @returns: a dictionary with the measurements
+    '''
+
+    import multiprocessing
+
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run_in_child,
+                                      args=(queue, name, documents, weights,
+                                            rater_class))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+if __name__ == '__main__':
+
+    import getopt
+    import sys
+
+    from build_dict import load_dict
+
+    try:
+        options, args = getopt.getopt(sys.argv[1:], 's:l:b:r:d:o:')
+        options = dict(options)
+        sizes = options.get('-s', 'tests').split(',')
+        document_size = parse_size(options.get('-l', '4K'))
+        benchmarks = options.get('-b', ','.join(BENCHMARKS)).split(',')
+        rater_name = options.get('-r', 'Rater')
+        rater_class = getattr(extras, rater_name)
+        dictionary = options.get('-d', 'data/dict.pkl')
+        if set(benchmarks) - set(BENCHMARKS):
+            raise ValueError(benchmarks)
+    except:
+        print __doc__
+        exit(1)
+
+    output = open(options['-o'], 'a') if '-o' in options else sys.stdout
+    weights = load_dict(dictionary)
+
+    for size in sizes:
+        if size == 'tests':
+            documents = sample_documents()
+        else:
+            documents = synthetic_corpus(parse_size(size), document_size)
+        corpus_size = sum(map(len, documents))
+
+        for name in benchmarks:
+            result = isolated(name, documents, weights, rater_class)
+            result.update({'benchmark': name, 'corpus': size,
+                           'bytes': corpus_size, 'rater': rater_name})
+            output.write(json.dumps(result, sort_keys=True) + '\n')
+            output.flush()
@@ -22,14 +22,54 @@
 
 
 '''
-Usage: build_dict.py -o <output file> -s <stopwords file> <list of files>
+Usage: build_dict.py [-c] [-q <bits>] [-m <min count>] [-p <tolerance>]
+                     [-j <workers>] [-u <stats file>] [-e <error>]
+                     -o <output file> -s <stopwords file> <list of files>
+
+  -c  save the dictionary in the compact format (see L{CompactDict}) instead
+      of pickling it
+  -q  quantize the weights to 8 or 16 bits (implies -c)
+  -m  leave out the words found in fewer documents (defaults to 1, or to 2
+      with -e)
+  -p  leave out the words whose weight is within the given tolerance (e.g.
+      0.1) of the default weight of the rater (1.0), see L{prune_dict}
+  -j  number of processes reading the corpus in parallel (defaults to 1)
+  -u  file with the word counts of the documents processed so far (created
+      if missing): the given files are added to it and the dictionary is
+      built from all the documents
+  -e  count the words approximately, in a fixed amount of memory, with the
+      given maximum error of each count relative to the total of the counts
+      (the sum of the numbers of distinct words of each document, or the
+      number of words for ICF; e.g. 1e-7; see L{SketchStats})
 '''
 
+import bisect
+import collections
+import itertools
+import struct
+
 from tagger import Stemmer
 from extras import SimpleReader
 
 
-def build_dict(corpus, stopwords=None, measure='IDF'):
+# layout of the compact format: header (magic string, type of the weights,
+# number of entries), offsets of the keys (number of entries + 1), packed
+# weights, sorted keys, and optionally a block index: header (magic string,
+# number of entries in each block, number of blocks), offsets of the first
+# keys of the blocks (number of blocks + 1), first keys of the blocks
+COMPACT_MAGIC = 'TGD1'
+COMPACT_HEADER = '<4scxxxI'
+# types of the weights by number of bits: 8 and 16 bits store weights in
+# [0,1] quantized to integers
+COMPACT_TYPECODES = {8: 'B', 16: 'H', 64: 'd'}
+COMPACT_QUANTA = {'B': 255, 'H': 65535}
+COMPACT_INDEX_MAGIC = 'TGDI'
+COMPACT_INDEX_HEADER = '<4sII'
+
+_missing = object()
+
+
+def build_dict(corpus, stopwords=None, measure='IDF', min_count=1):
     '''
     @param corpus:    a list of documents, represented as lists of (stemmed)
                       words
@@ -37,49 +77,571 @@ def build_dict(corpus, stopwords=None, measure='IDF'):
     @param measure:   the measure used to compute the weights ('IDF'
                       i.e. 'inverse document frequency' or 'ICF' i.e.
                       'inverse collection frequency'; defaults to 'IDF')
+    @param min_count: see L{CorpusStats.build_dict}
 
     @returns: a dictionary of weights in the interval [0,1]
     '''
 
-    import collections
-    import math
+    stats = CorpusStats()
+    for doc in corpus:
+        stats.add_document(doc)
 
-    dictionary = {}
+    return stats.build_dict(stopwords, measure, min_count)
 
-    if measure == 'ICF':
-        words = [w for doc in corpus for w in doc]
-        
-        term_count = collections.Counter(words)
-        total_count = float(len(words))
-        scale = math.log(total_count)
-    
-        for w, cnt in term_count.iteritems():
-            dictionary[w] = math.log(total_count / (cnt + 1)) / scale
 
-    elif measure == 'IDF':
-        corpus_size = float(len(corpus))
-        scale = math.log(corpus_size)
+class CorpusStats:
+    '''
+    Counts of the words in a corpus, i.e. all that is needed to compute the
+    weights of a dictionary (the documents themselves are not kept)
+
+    (the object can be pickled and updated later on with new documents, so
+    that the dictionary of a growing corpus is rebuilt in time proportional
+    to the size of its vocabulary instead of the whole corpus)
+    '''
+
+    def __init__(self):
+        '''
+        @returns: a new (empty) L{CorpusStats} object
+        '''
+
+        self.documents = 0
+        self.words = 0
+        self.document_count = collections.Counter()
+        self.term_count = collections.Counter()
+
+    def add_document(self, doc):
+        '''
+        @param doc: a document, represented as a list of (stemmed) words
+        '''
+
+        self.documents += 1
+        self.words += len(doc)
+        self.document_count.update(set(doc))
+        self.term_count.update(doc)
+
+    def update(self, other):
+        '''
+        @param other: a L{CorpusStats} object whose counts should be added to
+                      these ones (e.g. computed on a different shard of the
+                      corpus)
+        '''
+
+        self.documents += other.documents
+        self.words += other.words
+        self.document_count.update(other.document_count)
+        self.term_count.update(other.term_count)
+
+    def build_dict(self, stopwords=None, measure='IDF', min_count=1):
+        '''
+        @param stopwords: the list of (stemmed) words that should have zero
+                          weight
+        @param measure:   the measure used to compute the weights ('IDF'
+                          i.e. 'inverse document frequency' or 'ICF' i.e.
+                          'inverse collection frequency'; defaults to 'IDF')
+        @param min_count: minimum number of documents (of occurrences, for
+                          ICF) where a word must be found to be included
+                          (rarer words, mostly typos and other noise, are
+                          given the default weight of the rater)
+
+        @returns: a dictionary of weights in the interval [0,1]
+        '''
+
+        import math
+
+        dictionary = {}
+
+        # a corpus of a single document (or word) says nothing about the
+        # frequency of words, which all get the default weight of the rater
+        if measure == 'ICF' and self.words <= 1:
+            for w, cnt in self.term_count.iteritems():
+                if cnt >= min_count:
+                    dictionary[w] = 1.0
+
+        elif measure == 'ICF':
+            total_count = float(self.words)
+            scale = math.log(total_count)
+
+            for w, cnt in self.term_count.iteritems():
+                if cnt >= min_count:
+                    dictionary[w] = math.log(total_count / (cnt + 1)) / scale
+
+        elif measure == 'IDF' and self.documents <= 1:
+            for w, cnt in self.document_count.iteritems():
+                if cnt >= min_count:
+                    dictionary[w] = 1.0
+
+        elif measure == 'IDF':
+            corpus_size = float(self.documents)
+            scale = math.log(corpus_size)
+
+            for w, cnt in self.document_count.iteritems():
+                if cnt >= min_count:
+                    dictionary[w] = math.log(corpus_size / (cnt + 1)) / scale
+
+        if stopwords:
+            for w in stopwords:
+                dictionary[w] = 0.0
+
+        return dictionary
+
+
+class SketchStats(CorpusStats):
+    '''
+    Approximate counts of the words in a corpus, taking a fixed amount of
+    memory however large its vocabulary is
+
+    (the counts are kept in count-min sketches, which may only overestimate
+    them, and only the most frequent words are remembered: the others are
+    left out of the dictionary, and the rater gives them its default weight,
+    which is close to the weight of any rare word anyway)
+
+    (the error of a count is bounded by a fraction of the total of all the
+    counts: for the document counts, that is the sum of the numbers of
+    distinct words of each document, far larger than the number of
+    documents; see L{max_errors})
+    '''
+
+    def __init__(self, error=1e-5, probability=1e-3, capacity=1000000,
+                 min_count=2):
+        '''
+        @param error:       maximum error of each count, relative to the
+                            total of the counts (i.e. the sum of the numbers
+                            of distinct words of each document, for document
+                            counts, or the number of words, for ICF)
+        @param probability: probability of a count exceeding that error
+        @param capacity:    maximum number of words in the dictionary (the
+                            most frequent ones are kept)
+        @param min_count:   minimum (estimated) number of documents where a
+                            word must be found to be remembered
 
-        term_count = collections.defaultdict(int)
+        @returns: a new (empty) L{SketchStats} object
+        '''
 
-        for doc in corpus:
-            words = set(doc)
-            for w in words:
-                term_count[w] += 1
+        import array
+        import math
 
+        self.documents = 0
+        self.words = 0
+        # total of the document counts, i.e. the number of (document, word)
+        # pairs
+        self.pairs = 0
+        self.error = error
+        self.width = int(math.ceil(math.e / error))
+        self.depth = int(math.ceil(math.log(1.0 / probability)))
+        self.capacity = capacity
+        self.min_count = min_count
+        self.document_sketch = array.array('L', [0]) * \
+            (self.width * self.depth)
+        self.term_sketch = array.array('L', [0]) * (self.width * self.depth)
+        self.candidates = set()
+
+    def add_document(self, doc):
+        self.documents += 1
+        self.words += len(doc)
+        self.add_counts(dict.fromkeys(doc, 1), collections.Counter(doc))
+
+    def update(self, other):
+        '''
+        @param other: a L{CorpusStats} object (exact, e.g. computed on a
+                      shard of the corpus, or a L{SketchStats} of the same
+                      size) whose counts should be added to these ones
+        '''
+
+        if not isinstance(other, SketchStats):
+            self.documents += other.documents
+            self.words += other.words
+            self.add_counts(other.document_count, other.term_count)
+            return
+
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError('sketches of different sizes')
+        self.documents += other.documents
+        self.words += other.words
+        self.pairs += other.pairs
+        for i, cnt in enumerate(other.document_sketch):
+            self.document_sketch[i] += cnt
+        for i, cnt in enumerate(other.term_sketch):
+            self.term_sketch[i] += cnt
+        self.candidates.update(other.candidates)
+        self.prune(self.capacity)
+
+    def add_counts(self, document_count, term_count):
+        '''
+        @param document_count: a dictionary with the number of documents
+                               where each word is found
+        @param term_count:     a dictionary with the number of occurrences of
+                               each word
+        '''
+
+        for w, cnt in document_count.iteritems():
+            self.pairs += cnt
+            if self.add(self.document_sketch, w, cnt) >= self.min_count:
+                self.candidates.add(w)
         for w, cnt in term_count.iteritems():
-            dictionary[w] = math.log(corpus_size / (cnt + 1)) / scale
-            
-    if stopwords:
-        for w in stopwords:
-            dictionary[w] = 0.0
-    
-    return dictionary
+            self.add(self.term_sketch, w, cnt)
+
+        # forget the least frequent words only once in a while
+        if len(self.candidates) > 2 * self.capacity:
+            self.prune(self.capacity)
+
+    def max_errors(self):
+        '''
+        @returns: the maximum overestimates of the document counts and of the
+                  term counts (each exceeded only with the given
+                  probability), given the documents counted so far
+        '''
+
+        return self.error * self.pairs, self.error * self.words
+
+    def prune(self, size):
+        '''
+        @param size: number of (most frequent) words to be remembered
+        '''
+
+        if len(self.candidates) > size:
+            count = lambda w: self.estimate(self.document_sketch, w)
+            self.candidates = set(sorted(self.candidates, key=count,
+                                         reverse=True)[:size])
+
+    def cells(self, word):
+        '''
+        @param word: a word
+
+        @returns: the positions of the cells counting the word (one for each
+                  row of a sketch)
+        '''
+
+        # double hashing, from the two halves of the hash of the word (which
+        # is the same in every run, unless randomized with python -R, so that
+        # sketches can be saved and updated later on)
+        h = hash(word)
+        h1 = h & 0xffffffff
+        h2 = (h >> 32) & 0xffffffff | 1
+        width = self.width
+        return [row * width + (h1 + row * h2) % width
+                for row in xrange(self.depth)]
+
+    def add(self, sketch, word, count):
+        '''
+        @returns: the estimated count of the word, after adding the given
+                  count to it
+        '''
+
+        estimate = None
+        for i in self.cells(word):
+            sketch[i] += count
+            if estimate is None or sketch[i] < estimate:
+                estimate = sketch[i]
+        return estimate
+
+    def estimate(self, sketch, word):
+        '''
+        @returns: the estimated count of the word (never lower than the
+                  exact one)
+        '''
+
+        return min(sketch[i] for i in self.cells(word))
+
+    def build_dict(self, stopwords=None, measure='IDF', min_count=1):
+        self.prune(self.capacity)
+
+        stats = CorpusStats()
+        stats.documents = self.documents
+        stats.words = self.words
+        for w in self.candidates:
+            stats.document_count[w] = self.estimate(self.document_sketch, w)
+            stats.term_count[w] = self.estimate(self.term_sketch, w)
+
+        return stats.build_dict(stopwords, measure, min_count)
+
+
+class CompactDict:
+    '''
+    Read-only dictionary of weights stored in the compact format written by
+    L{write_compact_dict}
+
+    (the file is memory-mapped and looked up with a binary search, so loading
+    takes no time and all the processes using the same file share its pages;
+    with a block index, only the first key of each block is kept in memory
+    and a lookup reads the pages of a single block, so even dictionaries with
+    tens of millions of entries stay on disk)
+    '''
+
+    def __init__(self, filename, cache_size=0):
+        '''
+        @param filename:   the path of a dictionary in the compact format
+        @param cache_size: maximum number of looked up weights to remember
+                           (the least recently used ones are forgotten
+                           first; 0 disables the cache, None makes it
+                           unbounded)
+
+        @returns: a new L{CompactDict} object
+        '''
+
+        import mmap
+
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.typecode, self.size = struct.unpack_from(COMPACT_HEADER,
+                                                             self.data)
+        if magic != COMPACT_MAGIC:
+            raise ValueError('%s is not a compact dictionary' % filename)
+
+        self.offsets = struct.calcsize(COMPACT_HEADER)
+        self.weights = self.offsets + 4 * (self.size + 1)
+        self.keys = self.weights + \
+            struct.calcsize(self.typecode) * self.size
+        self.quantum = COMPACT_QUANTA.get(self.typecode)
+        self.index = None
+        self.block_size = 0
+        self.load_index(self.keys + self.key_offset(self.size))
+
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        return self.filename, self.cache_size
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for i in xrange(self.size):
+            yield self.key(i)
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def __getitem__(self, key):
+        weight = self.get(key, _missing)
+        if weight is _missing:
+            raise KeyError(key)
+        return weight
+
+    def get(self, key, default=None):
+        if self.cache_size == 0:
+            i = self.find(key)
+            if i < 0:
+                return default
+            return self.weight(i)
+
+        try:
+            weight = self.cache.pop(key)
+            self.hits += 1
+        except KeyError:
+            # missing keys are remembered too (as None)
+            i = self.find(key)
+            weight = self.weight(i) if i >= 0 else None
+            self.misses += 1
+            if self.cache_size and len(self.cache) >= self.cache_size:
+                self.cache.popitem(last=False)
+        # (re)insert the weight as the most recently used one
+        self.cache[key] = weight
+        if weight is None:
+            return default
+        return weight
+
+    def cache_info(self):
+        '''
+        @returns: a dictionary with the hits, misses and current size of the
+                  cache of weights
+        '''
+
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self.cache), 'max_size': self.cache_size}
+
+    def clear_cache(self):
+        '''
+        Forget all the cached weights and reset the counters
+        '''
+
+        self.cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def load_index(self, start):
+        '''
+        @param start: the position of the block index in the file, if any
+        '''
+
+        size = struct.calcsize(COMPACT_INDEX_HEADER)
+        if len(self.data) < start + size:
+            return
+        magic, block_size, blocks = struct.unpack_from(COMPACT_INDEX_HEADER,
+                                                       self.data, start)
+        if magic != COMPACT_INDEX_MAGIC:
+            return
+
+        start += size
+        offsets = struct.unpack_from('<%dI' % (blocks + 1), self.data, start)
+        start += 4 * (blocks + 1)
+        keys = self.data[start:start + offsets[-1]]
+        self.index = [keys[offsets[b]:offsets[b + 1]]
+                      for b in xrange(blocks)]
+        self.block_size = block_size
+
+    def iteritems(self):
+        for i in xrange(self.size):
+            yield self.key(i), self.weight(i)
+
+    def key(self, i):
+        '''
+        @param i: the position of an entry
+
+        @returns: the key of the i-th entry (in sorted order)
+        '''
+
+        start, end = struct.unpack_from('<II', self.data, self.offsets + 4 * i)
+        return self.data[self.keys + start:self.keys + end]
+
+    def key_offset(self, i):
+        return struct.unpack_from('<I', self.data, self.offsets + 4 * i)[0]
+
+    def weight(self, i):
+        '''
+        @param i: the position of an entry
+
+        @returns: the weight of the i-th entry (in sorted order)
+        '''
+
+        size = struct.calcsize(self.typecode)
+        weight = struct.unpack_from('<' + self.typecode, self.data,
+                                    self.weights + size * i)[0]
+        if self.quantum:
+            return weight / float(self.quantum)
+        return weight
+
+    def find(self, key):
+        '''
+        @param key: the key to look for
+
+        @returns: the position of the key, or -1 if it is not present
+        '''
+
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+
+        low, high = 0, self.size
+        if self.index is not None:
+            # search only the block that may contain the key
+            block = bisect.bisect_right(self.index, key) - 1
+            if block < 0:
+                return -1
+            low = block * self.block_size
+            high = min(low + self.block_size, self.size)
+
+        while low < high:
+            middle = (low + high) // 2
+            current = self.key(middle)
+            if current < key:
+                low = middle + 1
+            elif current > key:
+                high = middle
+            else:
+                return middle
+        return -1
+
+
+def write_compact_dict(dictionary, output_file, block_size=64, bits=64):
+    '''
+    @param dictionary:  a dictionary of weights
+    @param output_file: the binary stream where the dictionary should be saved
+                        in the format read by L{CompactDict}
+    @param block_size:  number of entries in each block of the index (0 means
+                        no index, so that lookups search the whole file)
+    @param bits:        size of each weight (8 or 16 quantize the weights,
+                        clipped to the interval [0,1]; defaults to 64, i.e.
+                        full floats)
+    '''
+
+    import array
+
+    typecode = COMPACT_TYPECODES[bits]
+    quantum = COMPACT_QUANTA.get(typecode)
+
+    items = []
+    for k, w in dictionary.iteritems():
+        if isinstance(k, unicode):
+            k = k.encode('utf-8')
+        if quantum:
+            w = int(round(min(max(w, 0.0), 1.0) * quantum))
+        items.append((k, w))
+    items.sort()
+
+    offsets = array.array('I', [0])
+    for k, w in items:
+        offsets.append(offsets[-1] + len(k))
+
+    output_file.write(struct.pack(COMPACT_HEADER, COMPACT_MAGIC, typecode,
+                                  len(items)))
+    output_file.write(struct.pack('<%dI' % len(offsets), *offsets))
+    output_file.write(struct.pack('<%d%s' % (len(items), typecode),
+                                  *[w for k, w in items]))
+    output_file.write(''.join(k for k, w in items))
+
+    if block_size:
+        firsts = [k for k, w in items[::block_size]]
+        offsets = array.array('I', [0])
+        for k in firsts:
+            offsets.append(offsets[-1] + len(k))
+
+        output_file.write(struct.pack(COMPACT_INDEX_HEADER,
+                                      COMPACT_INDEX_MAGIC, block_size,
+                                      len(firsts)))
+        output_file.write(struct.pack('<%dI' % len(offsets), *offsets))
+        output_file.write(''.join(firsts))
+
+
+def prune_dict(dictionary, tolerance, default=1.0):
+    '''
+    @param dictionary: a dictionary of weights
+    @param tolerance:  maximum difference from the default weight of the
+                       entries to be left out
+    @param default:    the weight given by the rater to the words that are
+                       not in the dictionary
+
+    @returns: a new dictionary without the entries whose weight is within
+              the tolerance of the default one (mostly rare words: once left
+              out, their weight, and therefore the rating of their tags,
+              grows by at most the tolerance)
+    '''
+
+    return dict((w, x) for w, x in dictionary.iteritems()
+                if abs(x - default) > tolerance)
+
+
+def load_dict(filename, cache_size=0):
+    '''
+    @param filename:   the path of a dictionary, either pickled or saved in
+                       the compact format
+    @param cache_size: see L{CompactDict.__init__} (ignored for pickled
+                       dictionaries)
+
+    @returns: a dictionary of weights to be passed to a L{Rater}
+    '''
+
+    import pickle
+
+    with open(filename, 'rb') as f:
+        compact = f.read(len(COMPACT_MAGIC)) == COMPACT_MAGIC
+        if not compact:
+            f.seek(0)
+            return pickle.load(f)
+    return CompactDict(filename, cache_size)
 
 
 def build_dict_from_files(output_file, corpus_files, stopwords_file=None,
                           reader=SimpleReader(), stemmer=Stemmer(),
-                          measure='IDF', verbose=False):
+                          measure='IDF', verbose=False, compact=False,
+                          workers=1, chunksize=64, stats=None, min_count=1,
+                          bits=64, prune=None):
     '''
     @param output_file:    the binary stream where the dictionary should be
                            saved
@@ -92,15 +654,43 @@ def build_dict_from_files(output_file, corpus_files, stopwords_file=None,
                            'inverse collection frequency'; defaults to 'IDF')
     @param verbose:        whether information on the progress should be
                            printed on screen
+    @param compact:        whether the dictionary should be saved in the
+                           compact format instead of being pickled
+    @param workers:        number of processes counting the words (more than
+                           one splits the corpus in shards counted in
+                           parallel)
+    @param chunksize:      number of documents in each shard
+    @param stats:          a L{CorpusStats} object with the counts of the
+                           documents processed earlier, to be updated with
+                           the new ones (the dictionary is then built from
+                           the whole collection)
+    @param min_count:      see L{CorpusStats.build_dict}
+    @param bits:           size of the weights in the compact format (see
+                           L{write_compact_dict})
+    @param prune:          if given, the tolerance used to leave out the
+                           words whose weight is close to the default one of
+                           the rater (see L{prune_dict})
     '''
 
     import pickle
 
     if verbose: print 'Processing corpus...'
-    corpus = []
-    for doc in corpus_files:
-        corpus.append(reader(doc.read()))
-    corpus = [[w.stem for w in map(stemmer, doc)] for doc in corpus]
+    if stats is None:
+        stats = CorpusStats()
+    texts = (doc.read() for doc in corpus_files)
+    if workers > 1:
+        import multiprocessing
+
+        pool = multiprocessing.Pool(workers, _init_worker, (reader, stemmer))
+        try:
+            for shard_stats in pool.imap_unordered(_count_shard,
+                                                   _shards(texts, chunksize)):
+                stats.update(shard_stats)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _count_texts(texts, reader, stemmer, stats)
 
     stopwords = None
     if stopwords_file:
@@ -109,8 +699,50 @@ def build_dict_from_files(output_file, corpus_files, stopwords_file=None,
         stopwords = [w.stem for w in map(stemmer, stopwords)]
 
     if verbose: print 'Building dictionary... '
-    dictionary = build_dict(corpus, stopwords, measure)
-    pickle.dump(dictionary, output_file, -1) 
+    dictionary = stats.build_dict(stopwords, measure, min_count)
+    if prune is not None:
+        dictionary = prune_dict(dictionary, prune)
+    if compact:
+        write_compact_dict(dictionary, output_file, bits=bits)
+    else:
+        pickle.dump(dictionary, output_file, -1) 
+
+
+_worker_reader = None
+_worker_stemmer = None
+
+
+def _init_worker(reader, stemmer):
+    global _worker_reader, _worker_stemmer
+    _worker_reader = reader
+    _worker_stemmer = stemmer
+
+
+def _count_shard(texts):
+    return _count_texts(texts, _worker_reader, _worker_stemmer)
+
+
+def _count_texts(texts, reader, stemmer, stats=None):
+    if stats is None:
+        stats = CorpusStats()
+    for text in texts:
+        stats.add_document([stemmer(t).stem for t in reader(text)])
+    return stats
+
+
+def _shards(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        shard = list(itertools.islice(iterator, size))
+        if not shard:
+            return
+        yield shard
+
+
+def _open_files(filenames):
+    for filename in filenames:
+        with open(filename, 'r') as f:
+            yield f
     
 
 if __name__ == '__main__':
@@ -119,24 +751,53 @@ if __name__ == '__main__':
     import sys
     
     try:
-        options = getopt.getopt(sys.argv[1:], 'o:s:')
-        output_file = options[0][0][1]
-        stopwords_file = options[0][1][1]
-        corpus = options[1]
+        options, corpus = getopt.getopt(sys.argv[1:], 'co:s:j:u:q:m:p:e:')
+        options = dict(options)
+        output_file = options['-o']
+        stopwords_file = options['-s']
+        workers = int(options.get('-j', 1))
+        bits = int(options.get('-q', 64))
+        if bits not in COMPACT_TYPECODES:
+            raise ValueError(bits)
+        error = float(options['-e']) if '-e' in options else None
+        min_count = int(options.get('-m', 2 if error else 1))
+        prune = float(options['-p']) if '-p' in options else None
     except:
         print __doc__
         exit(1)
+
+    import os
+    import pickle
+
+    # pickled statistics should refer to this module by name, not __main__
+    from build_dict import CorpusStats, SketchStats
+
+    stats = None
+    stats_file = options.get('-u')
+    if stats_file and os.path.exists(stats_file):
+        with open(stats_file, 'rb') as f:
+            stats = pickle.load(f)
+    elif error:
+        # the sketch forgets the rarer words as it goes, not only at the end
+        stats = SketchStats(error, min_count=min_count)
+    elif stats_file:
+        stats = CorpusStats()
     
-    corpus = [open(doc, 'r') for doc in corpus]
     stopwords_file = open(stopwords_file, 'r')
     output_file = open(output_file, 'wb')
 
-    build_dict_from_files(output_file, corpus, stopwords_file, verbose=True)
+    build_dict_from_files(output_file, _open_files(corpus), stopwords_file,
+                          verbose=True,
+                          compact='-c' in options or '-q' in options,
+                          workers=workers, stats=stats, min_count=min_count,
+                          bits=bits, prune=prune)
 
     output_file.close()
     stopwords_file.close()
-    for doc in corpus:
-        doc.close()
+
+    if stats_file:
+        with open(stats_file, 'wb') as f:
+            pickle.dump(stats, f, -1)
     
                
 
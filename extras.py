@@ -19,21 +19,90 @@
 # THE SOFTWARE
 
 
+import codecs
+import collections
+import re
+
 from tagger import *
 
 
+class FoldingTable(dict):
+    '''
+    Dictionary mapping each non-ASCII character to its closest ASCII
+    representation, computed the first time the character is seen
+    '''
+
+    # pairs of surrogates, found in non-BMP characters on narrow builds
+    match_surrogates = re.compile(u'[\ud800-\udbff][\udc00-\udfff]')
+
+    def __missing__(self, char):
+        folded = self.normalize(char)
+        self[char] = folded
+        return folded
+
+    def normalize(self, text):
+        import unicodedata
+
+        text = unicodedata.normalize('NFKD', text)
+        return text.encode('ascii', 'ignore').decode('ascii')
+
+    def fold(self, error):
+        '''
+        Error handler for the 'ascii' codec (registered as 'ascii-fold')
+
+        @param error: a UnicodeEncodeError
+
+        @returns: the replacement of the non-ASCII characters and the
+                  position where the encoding resumes
+        '''
+
+        chars = error.object[error.start:error.end]
+        if self.match_surrogates.search(chars):
+            return self.normalize(chars), error.end
+        # non-ASCII marks are dropped anyway, so folding each character on
+        # its own gives the same result as normalizing the whole string
+        return u''.join([self[c] for c in chars]), error.end
+
+
 class UnicodeReader(Reader):
     '''
     Reader subclass that converts Unicode strings to a close ASCII
     representation
     '''
 
+    # shared by all the readers, so that each character is folded only once
+    folding_table = FoldingTable()
+
     def __call__(self, text):
-        import unicodedata
+        return Reader.__call__(self, self.normalize(text))
+
+    def stream(self, source, chunk_size=65536):
+        import functools
+        import itertools
+
+        if hasattr(source, 'read'):
+            source = iter(functools.partial(source.read, chunk_size), '')
+        return Reader.stream(self, itertools.imap(self.normalize, source))
+
+    def normalize(self, text):
+        '''
+        @param text: a (Unicode) string
+
+        @returns: the closest ASCII representation of the string
+        '''
+
+        # most documents are plain ASCII already
+        try:
+            return text.encode('ascii')
+        except UnicodeError:
+            if isinstance(text, str):
+                raise
+
+        # only the non-ASCII characters are passed to the folding table
+        return unicode(text).encode('ascii', 'ascii-fold')
 
-        text = unicode(text)
-        text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore')
-        return Reader.__call__(self, text)
+
+codecs.register_error('ascii-fold', UnicodeReader.folding_table.fold)
 
 
 class HTMLReader(UnicodeReader):
@@ -41,12 +110,128 @@ class HTMLReader(UnicodeReader):
     Reader subclass that can parse HTML code from the input
     '''
 
+    # elements whose text is not part of the content
+    skipped_tags = frozenset(['script', 'style', 'noscript', 'template'])
+    # elements that end a paragraph
+    block_tags = frozenset(['address', 'article', 'aside', 'blockquote',
+                            'br', 'dd', 'div', 'dl', 'dt', 'figcaption',
+                            'footer', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+                            'header', 'hr', 'li', 'main', 'nav', 'ol', 'p',
+                            'pre', 'section', 'table', 'td', 'th', 'title',
+                            'tr', 'ul'])
+
+    def __init__(self, single_pass=False, incremental=False, encoding=None):
+        '''
+        @param single_pass: see L{Reader.__init__}
+        @param incremental: whether the text should be collected by an event
+                            parser (skipping scripts and styles, and breaking
+                            paragraphs at block elements) instead of building
+                            the whole document tree
+        @param encoding:    the encoding of the HTML code, if known (by
+                            default it is taken from the charset declared
+                            by the page, and pages with no declaration are
+                            read as latin-1: pass 'utf-8' for crawled pages,
+                            which mostly are)
+
+        @returns: a new L{HTMLReader} object
+        '''
+
+        UnicodeReader.__init__(self, single_pass)
+        self.incremental = incremental
+        self.encoding = encoding
+
     def __call__(self, html):
+        if self.incremental:
+            text = u''.join(self.extract([html]))
+            return UnicodeReader.__call__(self, text)
+
         import lxml.html
 
         text = lxml.html.fromstring(html).text_content().encode('utf-8')
         return UnicodeReader.__call__(self, text)
 
+    def stream(self, source, chunk_size=65536):
+        import functools
+
+        if hasattr(source, 'read'):
+            source = iter(functools.partial(source.read, chunk_size), '')
+        return UnicodeReader.stream(self, self.extract(source))
+
+    def extract(self, chunks):
+        '''
+        @param chunks: an iterable of strings whose concatenation is the
+                       HTML code
+
+        @returns: an iterator over pieces of the text contained in the code,
+                  yielded as soon as they are parsed
+        '''
+
+        import lxml.etree
+
+        target = HTMLText(self.skipped_tags, self.block_tags)
+        parser = lxml.etree.HTMLParser(target=target, encoding=self.encoding)
+
+        rest = ''
+        for chunk in chunks:
+            # feed the parser only up to the end of the last tag, since it
+            # may lose the end of a script or style split between chunks
+            chunk = rest + chunk
+            end = chunk.rfind('>') + 1
+            rest = chunk[end:]
+            if not end:
+                continue
+            parser.feed(chunk[:end])
+            if target.pieces:
+                yield u''.join(target.pieces)
+                del target.pieces[:]
+
+        if rest:
+            parser.feed(rest)
+        parser.close()
+        if target.pieces:
+            yield u''.join(target.pieces)
+
+
+class HTMLText:
+    '''
+    Target of an lxml parser collecting the text of an HTML document
+    '''
+
+    def __init__(self, skipped_tags, block_tags):
+        '''
+        @param skipped_tags: names of the elements whose text is ignored
+        @param block_tags:   names of the elements followed by a newline
+
+        @returns: a new L{HTMLText} object
+        '''
+
+        self.skipped_tags = skipped_tags
+        self.block_tags = block_tags
+        self.pieces = []
+        self.skipping = 0
+
+    def start(self, tag, attrib):
+        if tag in self.skipped_tags:
+            self.skipping += 1
+        elif tag in self.block_tags:
+            self.pieces.append(u'\n')
+
+    def end(self, tag):
+        if tag in self.skipped_tags:
+            self.skipping -= 1
+        elif tag in self.block_tags:
+            self.pieces.append(u'\n')
+
+    def data(self, data):
+        if not self.skipping:
+            self.pieces.append(data)
+
+    def comment(self, text):
+        pass
+
+    def close(self):
+        pass
+
     
 class SimpleReader(Reader):
     '''
@@ -60,16 +245,27 @@ class SimpleReader(Reader):
         tags = [Tag(w) for w in words]
         return tags
 
+    def read_paragraphs(self, paragraphs):
+        return [Tag(w) for par in paragraphs
+                for w in self.match_words.findall(par.lower())]
+
 
 class FastStemmer(Stemmer):
     '''
     Stemmer subclass that uses a much faster, but less correct algorithm
     '''
 
-    def __init__(self):
+    def __init__(self, cache_size=0):
+        '''
+        @param cache_size: maximum number of stems to remember (see
+                           L{Stemmer.__init__})
+
+        @returns: a new L{FastStemmer} object
+        '''
+
         from stemming import porter
         
-        Stemmer.__init__(self, porter)
+        Stemmer.__init__(self, porter, cache_size)
 
 
 class NaiveRater(Rater):
@@ -78,19 +274,421 @@ class NaiveRater(Rater):
     weight
     '''
 
-    def __call__(self, tags):
+    def __call__(self, tags, tags_number=None):
         self.rate_tags(tags)
         # we still get rid of one-character tags
         unique_tags = set(t for t in tags if len(t.string) > 1)
-        return sorted(unique_tags)
+        return self.select(unique_tags, tags_number)
+
+
+class NumpyRater(Rater):
+    '''
+    Rater subclass that returns the same tags as L{Rater}, but computes term
+    frequencies, ratings of multitags and redundancies with vectorized
+    operations over integer ids of the (multi)tags (requires numpy)
+
+    (only the surviving tags are built as L{MultiTag} objects, so overriding
+    L{MultiTag.combined_rating} or L{Rater.create_multitags} has no effect)
+    '''
+
+    def __call__(self, tags, tags_number=None):
+        import numpy
+
+        if not tags:
+            return []
+
+        ids, stems, ratings = self.rate_ids(tags)
+
+        size = len(tags)
+        terminal = numpy.fromiter((t.terminal for t in tags), bool, size)
+        proper = numpy.fromiter((t.proper for t in tags), bool, size)
+        strings = {}
+        string_ids = numpy.fromiter(
+            (strings.setdefault(t.string, len(strings)) for t in tags),
+            numpy.int64, size)
+        nonzero = ratings > 0.0
+        nonzero_ratings = numpy.where(nonzero, ratings, 1.0)
+
+        # every (multi)tag of each size is identified by the id of its group
+        # (i.e. its stem), ids of all sizes being numbered consecutively
+        group_at = []       # group of the n-gram starting at each position
+        groups = []         # (positions, groups, first occurrences, ratings,
+                            # proper flags, string ids) for each size
+        offsets = []        # id of the first group of each size
+        offset = 0
+
+        positions = numpy.arange(size)
+        stem_keys, string_keys = ids, string_ids
+        product, nonzero_product = ratings, nonzero_ratings
+        nonzero_count = nonzero.astype(numpy.int64)
+        is_proper = proper
+
+        for n in xrange(1, self.multitag_size + 1):
+            if n > 1:
+                # extend the (n-1)-grams that don't end at a terminal tag
+                keep = positions + n - 1 < size
+                keep[keep] = ~terminal[positions[keep] + n - 2]
+                if not keep.any():
+                    break
+                positions = positions[keep]
+                last = positions + n - 1
+                stem_keys = stem_ids[keep] * len(stems) + ids[last]
+                string_keys = string_keys[keep] * len(strings) + \
+                    string_ids[last]
+                product = product[keep] * ratings[last]
+                nonzero_product = nonzero_product[keep] * \
+                    nonzero_ratings[last]
+                nonzero_count = nonzero_count[keep] + nonzero[last]
+                is_proper = is_proper[keep] & proper[last]
+
+            unique, first, stem_ids = numpy.unique(stem_keys,
+                                                   return_index=True,
+                                                   return_inverse=True)
+            string_keys = numpy.unique(string_keys, return_inverse=True)[1]
+
+            # geometric mean, skipping zeros in proper nouns
+            rating = numpy.power(product, 1.0 / n)
+            fix = (product == 0.0) & is_proper
+            rating[fix] = numpy.where(
+                nonzero_count[fix] > 0,
+                numpy.power(nonzero_product[fix],
+                            1.0 / numpy.maximum(nonzero_count[fix], 1)),
+                0.0)
+
+            at = numpy.full(size, -1, numpy.int64)
+            at[positions] = stem_ids + offset
+            group_at.append(at)
+            groups.append((positions, stem_ids, first, rating, is_proper,
+                           string_keys))
+            offsets.append(offset)
+            offset += len(unique)
+
+        # per-group statistics (representatives are first occurrences)
+        count = numpy.concatenate([numpy.bincount(g[1]) for g in groups])
+        rep_pos = numpy.concatenate([g[0][g[2]] for g in groups])
+        rep_size = numpy.concatenate([numpy.full(len(g[2]), n + 1,
+                                                 numpy.int64)
+                                      for n, g in enumerate(groups)])
+        rep_rating = numpy.concatenate([g[3][g[2]] for g in groups])
+        rep_proper = numpy.concatenate([g[4][g[2]] for g in groups])
+        proper_count = numpy.concatenate(
+            [numpy.bincount(g[1], g[4], len(g[2])) for g in groups])
+        proper_rating = numpy.zeros(offset)
+        for g, base in zip(groups, offsets):
+            numpy.maximum.at(proper_rating, g[1][g[4]] + base, g[3][g[4]])
+
+        mostly_proper = proper_count / count >= 0.5
+        rep_proper[mostly_proper] = True
+        rep_rating[mostly_proper] = proper_rating[mostly_proper]
+
+        # most frequent version of groups written in different ways
+        clusters = collections.defaultdict(collections.Counter)
+        for n, g in enumerate(groups):
+            positions, stem_ids, first, rating, is_proper, string_keys = g
+            width = string_keys.max() + 1
+            variants = numpy.unique(stem_ids * width + string_keys)
+            variants = numpy.bincount(variants // width)
+            versions = {}
+            for i in numpy.flatnonzero(variants[stem_ids] > 1):
+                key = string_keys[i]
+                if key not in versions:
+                    p = positions[i]
+                    versions[key] = ' '.join(t.string
+                                             for t in tags[p:p + n + 1])
+                clusters[offsets[n] + stem_ids[i]][versions[key]] += 1
+
+        def string(g):
+            if g in clusters:
+                return clusters[g].most_common(1)[0][0]
+            p = rep_pos[g]
+            return ' '.join(t.string for t in tags[p:p + rep_size[g]])
+
+        # stems of all groups, inserted in the same order as L{Rater} does
+        # so that ties are sorted in the same way
+        group_stems = list(stems)
+        for n in xrange(1, len(groups)):
+            positions, stem_ids, first = groups[n][:3]
+            for p in positions[first].tolist():
+                group_stems.append(' '.join([group_stems[group_at[n - 1][p]],
+                                             stems[ids[p + n]]]))
+        term_count = {}
+        for g in numpy.lexsort((rep_size, rep_pos)).tolist():
+            term_count[group_stems[g]] = g
+
+        unique_tags = set(s for s, g in term_count.iteritems()
+                          if rep_size[g] > 1 or len(string(g)) > 1)
+
+        # remove redundant tags
+        discarded = numpy.zeros(offset, bool)
+        for n in xrange(1, len(groups)):
+            positions, stem_ids, first = groups[n][:3]
+            t = group_at[n][positions[first]]
+            for l in xrange(n):
+                for i in xrange(n - l + 1):
+                    s = group_at[l][positions[first] + i]
+                    relative_freq = count[t] / count[s].astype(float)
+                    cond = (((relative_freq == 1.0) & rep_proper[t]) |
+                            ((relative_freq >= 0.5) & (rep_rating[t] > 0.0)))
+                    discarded[s[cond]] = True
+                    discarded[t[~cond]] = True
+        for g in numpy.flatnonzero(discarded).tolist():
+            unique_tags.discard(group_stems[g])
+
+        # sort (stably, as sorted() would) and build only the best tags
+        best = numpy.array([term_count[stem] for stem in unique_tags],
+                           numpy.int64)
+        best = best[numpy.argsort(-rep_rating[best], kind='mergesort')]
+        if tags_number is not None:
+            best = best[:tags_number]
+
+        result = []
+        for g in best.tolist():
+            p = rep_pos[g]
+            t = MultiTag(tags[p])
+            for tail in tags[p + 1:p + rep_size[g]]:
+                t = MultiTag(tail, t)
+            t.string = string(g)
+            t.proper = bool(rep_proper[g])
+            t.rating = float(rep_rating[g])
+            result.append(t)
+
+        return result
+
+    def rate_tags(self, tags):
+        self.rate_ids(tags)
+
+    def rate_ids(self, tags):
+        '''
+        @param tags: a list of tags to be assigned a rating
+
+        @returns: the array of the ids of the tags' stems, the list of the
+                  stems (indexed by id) and the array of the tags' ratings
+        '''
+
+        import numpy
+
+        index = {}
+        ids = numpy.fromiter((index.setdefault(t.stem, len(index))
+                              for t in tags), numpy.int64, len(tags))
+        stems = [None] * len(index)
+        for s, i in index.iteritems():
+            stems[i] = s
+
+        weights = numpy.array([self.weights.get(s, 1.0) for s in stems],
+                              float)
+        ratings = numpy.bincount(ids)[ids] / float(len(tags)) * weights[ids]
+        for t, r in zip(tags, ratings.tolist()):
+            t.rating = r
+
+        return ids, stems, ratings
     
         
+class DuplicateDetector:
+    '''
+    Index of the MinHash signatures of the documents tagged recently, finding
+    the near duplicates of a new document (through locality-sensitive
+    hashing) so that their tags can be reused
+
+    (the signatures are computed on the shingles, i.e. runs of consecutive
+    words, of the tags returned by a L{Reader}; documents are near duplicates
+    when the estimated similarity of their sets of shingles reaches the
+    threshold)
+    '''
+
+    # a Mersenne prime, larger than the hashes of the shingles (which are
+    # kept to 31 bits, so that the arithmetic never leaves machine integers)
+    prime = (1 << 31) - 1
+
+    def __init__(self, threshold=0.8, shingle_size=3, permutations=64,
+                 bands=16, capacity=10000, seed=0):
+        '''
+        @param threshold:    minimum (Jaccard) similarity of near duplicates
+        @param shingle_size: number of words in each shingle
+        @param permutations: number of hash functions in a signature
+        @param bands:        number of bands the signatures are split into
+                             for the index (a divisor of permutations: more
+                             bands find less similar candidates)
+        @param capacity:     maximum number of documents in the index (the
+                             least recently used ones are forgotten first;
+                             0 indexes nothing)
+        @param seed:         seed of the random hash functions
+
+        @returns: a new L{DuplicateDetector} object
+        '''
+
+        import random
+
+        if permutations % bands:
+            raise ValueError('bands must divide permutations')
+
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.permutations = permutations
+        self.bands = bands
+        self.capacity = capacity
+
+        rng = random.Random(seed)
+        self.hashes = [(rng.randrange(1, self.prime), rng.randrange(self.prime))
+                       for _ in xrange(permutations)]
+
+        self.entries = collections.OrderedDict()
+        self.buckets = collections.defaultdict(set)
+        self.next_id = 0
+        self.hits = 0
+        self.misses = 0
+
+    def signature(self, tags):
+        '''
+        @param tags: the list of tags of a document (as returned by a
+                     L{Reader})
+
+        @returns: the MinHash signature of the document (None if it has no
+                  tags)
+        '''
+
+        if not tags:
+            return None
+
+        words = [t.string for t in tags]
+        size = min(self.shingle_size, len(words))
+        shingles = set(hash(tuple(words[i:i + size])) & 0x7fffffff
+                       for i in xrange(len(words) - size + 1))
+
+        prime = self.prime
+        return tuple(min([(a * h + b) % prime for h in shingles])
+                     for a, b in self.hashes)
+
+    def bands_of(self, signature):
+        rows = self.permutations // self.bands
+        return [(b, signature[b * rows:(b + 1) * rows])
+                for b in xrange(self.bands)]
+
+    def get(self, signature, tags_number):
+        '''
+        @param signature:   the signature of a document
+        @param tags_number: number of best tags to be returned
+
+        @returns: (a copy of) the tags of the most similar document in the
+                  index, or None if there are no near duplicates (or their
+                  tags are fewer than needed)
+        '''
+
+        best = None
+        best_similarity = self.threshold
+        if signature is not None:
+            candidates = set()
+            for band in self.bands_of(signature):
+                candidates.update(self.buckets.get(band, ()))
+            for entry_id in candidates:
+                other, number, tags = self.entries[entry_id]
+                if number < tags_number and len(tags) == number:
+                    continue
+                similarity = sum(x == y for x, y in zip(signature, other)) / \
+                    float(self.permutations)
+                if similarity >= best_similarity:
+                    best, best_similarity = entry_id, similarity
+
+        if best is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        # the duplicate is now the most recently used document
+        entry = self.entries.pop(best)
+        self.entries[best] = entry
+        return map(self.copy, entry[2][:tags_number])
+
+    def put(self, signature, tags_number, tags):
+        '''
+        @param signature:   the signature of a document
+        @param tags_number: number of best tags requested for the document
+        @param tags:        the tags of the document
+        '''
+
+        if signature is None or self.capacity <= 0:
+            return
+
+        if len(self.entries) >= self.capacity:
+            entry_id, (other, number, other_tags) = \
+                self.entries.popitem(last=False)
+            for band in self.bands_of(other):
+                self.buckets[band].discard(entry_id)
+                if not self.buckets[band]:
+                    del self.buckets[band]
+
+        entry_id = self.next_id
+        self.next_id += 1
+        tags = map(self.copy, tags)
+        self.entries[entry_id] = (signature, tags_number, tags)
+        for band in self.bands_of(signature):
+            self.buckets[band].add(entry_id)
+
+    def copy(self, tag):
+        '''
+        @param tag: a L{Tag} (or L{MultiTag}) object
+
+        @returns: a copy of the tag, of the same class (see L{ResultCache.copy})
+        '''
+
+        import copy
+
+        tag = copy.copy(tag)
+        if isinstance(tag, MultiTag):
+            tag.head = tag.suffix = None
+        return tag
+
+
+class NearDuplicateTagger(Tagger):
+    '''
+    Tagger subclass that reuses the tags of the near duplicates of a document
+    (e.g. copies of the same news story with a different headline), found by
+    a L{DuplicateDetector}, instead of stemming and rating it again
+
+    (each process of L{Tagger.tag_many} has its own detector)
+    '''
+
+    def __init__(self, reader, stemmer, rater, detector=None, collector=None,
+                 cache=None):
+        '''
+        @param reader:    a L{Reader} object
+        @param stemmer:   a L{Stemmer} object
+        @param rater:     a L{Rater} object
+        @param detector:  the L{DuplicateDetector} object to be used
+        @param collector: an optional L{Collector} object counting the
+                          documents and their near duplicates (besides the
+                          measures of L{Tagger})
+        @param cache:     an optional L{ResultCache} object (see L{Tagger})
+
+        @returns: a new L{NearDuplicateTagger} object
+        '''
+
+        Tagger.__init__(self, reader, stemmer, rater, collector, cache)
+        self.detector = detector or DuplicateDetector()
+
+    def __call__(self, text, tags_number=5):
+        signature = self.detector.signature(self.reader(text))
+
+        duplicate_tags = self.detector.get(signature, tags_number)
+        if duplicate_tags is not None:
+            if self.collector:
+                self.collector.count('documents')
+                self.collector.count('near_duplicates')
+            return duplicate_tags
+
+        # the usual pipeline (with its cache and measures) on the others
+        tags = Tagger.__call__(self, text, tags_number)
+        self.detector.put(signature, tags_number, tags)
+        return tags
+
+
 def build_dict_from_nltk(output_file, corpus=None, stopwords=None,
-                         stemmer=Stemmer(), measure='IDF', verbose=False):
+                         stemmer=Stemmer(), measure='IDF', verbose=False,
+                         compact=False, cache_file=None, workers=1):
     '''
     @param output_file: the binary stream where the dictionary should be saved
     @param corpus:      the NLTK corpus to use (defaults to nltk.corpus.reuters)
-    @param stopwords:   a list of (not stemmed) stopwords (defaults to
+    @param stopwords:   a list of (not stemmed) stopwords (defaults to the
+                        ones saved in the cache file, if any, or else to
                         nltk.corpus.reuters.words('stopwords'))
     @param stemmer:     the L{Stemmer} object to be used
     @param measure:     the measure used to compute the weights ('IDF'
@@ -98,49 +696,224 @@ def build_dict_from_nltk(output_file, corpus=None, stopwords=None,
                         'inverse collection frequency'; defaults to 'IDF')
     @param verbose:     whether information on the progress should be printed
                         on screen
+    @param compact:     whether the dictionary should be saved in the compact
+                        format instead of being pickled
+    @param cache_file:  path of a file where the stemmed corpus (and
+                        stopwords) are saved the first time, and loaded from
+                        later on without using NLTK at all; it is rebuilt
+                        when the stemmer, or the files of the given corpus,
+                        differ from the ones it was made with (if no corpus
+                        is given, whichever corpus it holds is used)
+    @param workers:     number of processes stemming the corpus
     '''
     
-    from build_dict import build_dict
-    import nltk
+    from build_dict import build_dict, write_compact_dict
+    import os
     import pickle
 
-    if not (corpus and stopwords):
-        nltk.download('reuters')
-        
-    corpus = corpus or nltk.corpus.reuters
-    stopwords = stopwords or nltk.corpus.reuters.words('stopwords')
-
-    corpus_list = []
-    
-    if verbose: print 'Processing corpus...'
-    for file in corpus.fileids():
-        doc = [stemmer(Tag(w.lower())).stem for w in corpus.words(file)
-               if w[0].isalpha()]
-        corpus_list.append(doc)
+    documents = None
+    if cache_file and os.path.exists(cache_file):
+        if verbose: print 'Loading stemmed corpus...'
+        fingerprint, vocabulary, documents, cached_stopwords = \
+            _load_stemmed_corpus(cache_file)
+        if (fingerprint is None or
+            fingerprint[1] != _stemmer_fingerprint(stemmer) or
+            (corpus and fingerprint[0] != list(corpus.fileids()))):
+            if verbose: print 'Stale cache, processing corpus again...'
+            documents = None
+
+    fresh = documents is None
+    if fresh and not (corpus and stopwords is not None):
+        import nltk
 
-    if verbose: print 'Processing stopwords...'
-    stopwords = [stemmer(Tag(w.lower())).stem for w in stopwords]
+        nltk.download('reuters')
+        corpus = corpus or nltk.corpus.reuters
+        if stopwords is None:
+            stopwords = nltk.corpus.reuters.words('stopwords')
+
+    if fresh:
+        if verbose: print 'Processing corpus...'
+        texts = ([w.lower() for w in corpus.words(file) if w[0].isalpha()]
+                 for file in corpus.fileids())
+        vocabulary, documents = _stem_documents(texts, stemmer, workers)
+
+    if stopwords is not None:
+        if verbose: print 'Processing stopwords...'
+        stopwords = [stemmer(Tag(w.lower())).stem for w in stopwords]
+    else:
+        stopwords = cached_stopwords
+
+    if fresh and cache_file:
+        fingerprint = (list(corpus.fileids()), _stemmer_fingerprint(stemmer))
+        _save_stemmed_corpus(cache_file, fingerprint, vocabulary, documents,
+                             stopwords)
 
     if verbose: print 'Building dictionary... '
+    corpus_list = ([vocabulary[i] for i in doc] for doc in documents)
     dictionary = build_dict(corpus_list, stopwords, measure)
-    pickle.dump(dictionary, output_file, -1) 
+    if compact:
+        write_compact_dict(dictionary, output_file)
+    else:
+        pickle.dump(dictionary, output_file, -1)
 
 
+def _stem_documents(texts, stemmer, workers=1):
+    # stems the documents (lists of words), returning the list of the stems
+    # and the documents as arrays of their ids
+    import array
 
-    
+    pool = None
+    if workers > 1:
+        import multiprocessing
 
-    
+        pool = multiprocessing.Pool(workers, _init_stemmer, (stemmer,))
+        stemmed = pool.imap(_stem_words, texts, 16)
+    else:
+        stemmed = ([stemmer(Tag(w)).stem for w in words] for words in texts)
 
-     
+    ids = {}
+    vocabulary = []
+    documents = []
+    try:
+        for stems in stemmed:
+            doc = array.array('i')
+            for stem in stems:
+                if stem not in ids:
+                    ids[stem] = len(vocabulary)
+                    vocabulary.append(stem)
+                doc.append(ids[stem])
+            documents.append(doc)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
 
-    
+    return vocabulary, documents
 
-        
 
-    
+_worker_stemmer = None
 
 
+def _init_stemmer(stemmer):
+    global _worker_stemmer
+    _worker_stemmer = stemmer
 
 
+def _stem_words(words):
+    return [_worker_stemmer(Tag(w)).stem for w in words]
 
-        
+
+def _stemmer_fingerprint(stemmer):
+    # the names of the stemmer and of the stemmer (object or module) it
+    # wraps, which decide the stems saved in the cache
+    import types
+
+    fingerprint = []
+    for s in (stemmer, getattr(stemmer, 'stemmer', None)):
+        if isinstance(s, types.ModuleType):
+            fingerprint.append(s.__name__)
+        else:
+            fingerprint.append(s.__class__.__module__ + '.' +
+                               s.__class__.__name__)
+    return fingerprint
+
+
+def _save_stemmed_corpus(filename, fingerprint, vocabulary, documents,
+                         stopwords):
+    import pickle
+
+    with open(filename, 'wb') as f:
+        pickle.dump({'fingerprint': fingerprint,
+                     'vocabulary': vocabulary,
+                     'documents': [doc.tostring() for doc in documents],
+                     'stopwords': stopwords}, f, -1)
+
+
+def _load_stemmed_corpus(filename):
+    import array
+    import pickle
+
+    with open(filename, 'rb') as f:
+        cache = pickle.load(f)
+
+    documents = []
+    for data in cache['documents']:
+        doc = array.array('i')
+        doc.fromstring(data)
+        documents.append(doc)
+    return (cache.get('fingerprint'), cache['vocabulary'], documents,
+            cache['stopwords'])
+
+
+def tag_collection(documents, tags_number=5, reader=Reader(), stemmer=None,
+                   rater_class=Rater, stopwords=None, measure='IDF',
+                   stats=None):
+    '''
+    Tags a collection of documents without a prebuilt dictionary, weighting
+    the words by their frequency in the collection itself
+
+    (each document is read and stemmed only once: its tags are kept as ids
+    of their strings, together with their flags, until the weights are known
+    and the documents can be rated)
+
+    @param documents:   an iterable of strings of text to be tagged
+    @param tags_number: number of best tags to be returned for each document
+    @param reader:      the L{Reader} object to be used
+    @param stemmer:     the L{Stemmer} object to be used (defaults to a new
+                        L{Stemmer} caching the stems of the collection)
+    @param rater_class: a function returning a L{Rater} object, given the
+                        dictionary of weights
+    @param stopwords:   a list of (not stemmed) stopwords
+    @param measure:     the measure used to compute the weights ('IDF'
+                        i.e. 'inverse document frequency' or 'ICF' i.e.
+                        'inverse collection frequency'; defaults to 'IDF')
+    @param stats:       a L{CorpusStats} object where the words of the
+                        collection are counted (e.g. to build its dictionary
+                        later on)
+
+    @returns: a list with the tags of each document, in input order
+    '''
+
+    import array
+    from build_dict import CorpusStats
+
+    if stemmer is None:
+        stemmer = Stemmer(cache_size=None)
+    if stats is None:
+        stats = CorpusStats()
+
+    ids = {}
+    strings = []
+    stems = []
+    collection = []
+
+    for text in documents:
+        tags = map(stemmer, reader(text))
+        stats.add_document([t.stem for t in tags])
+
+        doc = array.array('i')
+        flags = bytearray(len(tags))
+        for i, t in enumerate(tags):
+            if t.string not in ids:
+                ids[t.string] = len(strings)
+                strings.append(t.string)
+                stems.append(t.stem)
+            doc.append(ids[t.string])
+            flags[i] = t.proper | t.terminal << 1
+        collection.append((doc, flags))
+
+    if stopwords:
+        stopwords = [stemmer(Tag(w.lower())).stem for w in stopwords]
+    weights = stats.build_dict(stopwords, measure)
+    # in a small collection, some words may be found in every document (and
+    # get a negative weight)
+    for w in weights:
+        weights[w] = max(weights[w], 0.0)
+    rater = rater_class(weights)
+
+    results = []
+    for doc, flags in collection:
+        tags = [Tag(strings[i], stems[i], proper=bool(f & 1),
+                    terminal=bool(f & 2)) for i, f in zip(doc, flags)]
+        results.append(rater.top(tags, tags_number))
+    return results
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2011 by Alessandro Presta
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE
+
+
+'''
+Usage: server.py [-p <port>] [-d <dictionary>] [-j <workers>]
+                 [-c <max concurrent requests>]
+
+Runs an HTTP server tagging the documents POSTed to it as JSON, either one
+({"text": "...", "tags": 5}) or many at once ({"documents": ["...", ...],
+"tags": 5}). The dictionary is loaded only once and the documents are tagged
+by a pool of worker processes; requests beyond the concurrency limit are
+refused with "503 Service Unavailable".
+
+  -p  port to listen on (defaults to 8000)
+  -d  dictionary, pickled or in the compact format (defaults to
+      data/dict.pkl)
+  -j  number of worker processes (defaults to the number of CPUs)
+  -c  maximum number of requests handled at the same time (defaults to 64)
+'''
+
+import BaseHTTPServer
+import json
+import SocketServer
+import threading
+
+
+class TaggerServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''
+    HTTP server tagging documents with a pool of processes
+    '''
+
+    daemon_threads = True
+    # the size of the listen queue, so that bursts are not refused by the
+    # operating system before reaching the concurrency limit
+    request_queue_size = 128
+
+    def __init__(self, address, tagger, workers=None, max_requests=64,
+                 max_body_size=16 * 1024 * 1024):
+        '''
+        @param address:       the (host, port) pair to listen on
+        @param tagger:        the L{Tagger} object to be used
+        @param workers:       number of worker processes (defaults to the
+                              number of CPUs)
+        @param max_requests:  maximum number of requests being handled at
+                              the same time
+        @param max_body_size: maximum size in bytes of a request body
+
+        @returns: a new L{TaggerServer} object
+        '''
+
+        # start the workers first, so that they don't inherit the socket
+        self.tagger = tagger
+        self.pool = tagger.create_pool(workers)
+        BaseHTTPServer.HTTPServer.__init__(self, address, TaggerHandler)
+        self.slots = threading.BoundedSemaphore(max_requests)
+        self.max_body_size = max_body_size
+
+    def server_close(self):
+        BaseHTTPServer.HTTPServer.server_close(self)
+        self.pool.close()
+        self.pool.join()
+
+    def tag(self, documents, tags_number):
+        '''
+        @param documents:   a list of strings of text to be tagged
+        @param tags_number: number of best tags to be returned for each
+                            document
+
+        @returns: a list with the tags of each document, in input order
+        '''
+
+        return self.tagger.tag_many(documents, tags_number, chunksize=1,
+                                    pool=self.pool)
+
+
+class TaggerHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    Handler of the requests to a L{TaggerServer}
+    '''
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.reply(200, {'status': 'ok'})
+        else:
+            self.reply(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if not self.server.slots.acquire(False):
+            self.reply(503, {'error': 'too many requests'},
+                       [('Retry-After', '1')])
+            return
+
+        try:
+            self.handle_tag()
+        finally:
+            self.server.slots.release()
+
+    def handle_tag(self):
+        try:
+            length = int(self.headers.getheader('Content-Length'))
+        except (TypeError, ValueError):
+            self.reply(411, {'error': 'missing or invalid content length'})
+            return
+        if length < 0:
+            self.reply(400, {'error': 'invalid content length'})
+            return
+        if length > self.server.max_body_size:
+            self.reply(413, {'error': 'request too large'})
+            return
+
+        try:
+            request = json.loads(self.rfile.read(length))
+            tags_number = int(request.get('tags', 5))
+            if 'documents' in request:
+                documents = request['documents']
+            else:
+                documents = [request['text']]
+            # a string would be taken for a list of one-letter documents
+            if not (isinstance(documents, list) and
+                    all(isinstance(d, basestring) for d in documents)):
+                raise TypeError(documents)
+            documents = [d.encode('utf-8') for d in documents]
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self.reply(400, {'error': 'malformed request'})
+            return
+
+        try:
+            results = [[{'tag': t.string, 'rating': t.rating} for t in tags]
+                       for tags in self.server.tag(documents, tags_number)]
+        except Exception:
+            self.log_error('error tagging the documents')
+            self.reply(500, {'error': 'internal error'})
+            return
+
+        if 'documents' in request:
+            self.reply(200, {'results': results})
+        else:
+            self.reply(200, {'tags': results[0]})
+
+    def reply(self, code, content, headers=()):
+        body = json.dumps(content)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for header in headers:
+            self.send_header(*header)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+if __name__ == '__main__':
+
+    import getopt
+    import sys
+
+    from build_dict import load_dict
+    from tagger import Tagger, Reader, Stemmer, Rater
+
+    try:
+        options, args = getopt.getopt(sys.argv[1:], 'p:d:j:c:')
+        options = dict(options)
+        port = int(options.get('-p', 8000))
+        dictionary = options.get('-d', 'data/dict.pkl')
+        workers = int(options['-j']) if '-j' in options else None
+        max_requests = int(options.get('-c', 64))
+    except:
+        print __doc__
+        exit(1)
+
+    print 'Loading dictionary... '
+    weights = load_dict(dictionary)
+    tagger = Tagger(Reader(), Stemmer(), Rater(weights))
+
+    server = TaggerServer(('', port), tagger, workers, max_requests)
+    print 'Listening on port', port
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
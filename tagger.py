@@ -54,10 +54,50 @@ Tagging a text document from Python::
     mytagger = Tagger(myreader, mystemmer, myrater)
     best_3_tags = mytagger(text_string, 3)
 
+Tagging many documents at once, spread over all the available CPUs::
+
+    all_tags = mytagger.tag_many(list_of_strings, 3, workers=4)
+
+Dictionaries can also be saved in a compact, memory-mapped format that loads
+instantly and is shared by all the processes using it (only a sparse index of
+the keys is kept in memory, so it suits vocabularies with tens of millions of
+words too)::
+
+    $ ./build_dict.py -c -o data/dict.tgd -s stopwords.txt corpus/*
+    # with weights of 16 bits, leaving out the words found in a single document
+    $ ./build_dict.py -q 16 -m 2 -o data/dict.tgd -s stopwords.txt corpus/*
+
+    import build_dict
+    weights = build_dict.load_dict('data/dict.tgd') # pickles work too
+    # remembering the weights of the most recently used words
+    weights = build_dict.load_dict('data/dict.tgd', cache_size=100000)
+
+Tagging a whole collection with no dictionary at hand, weighting the words by
+their frequency in the collection itself (every document is read only once)::
+
+    import extras
+    all_tags = extras.tag_collection(list_of_strings, 3)
+
+Reusing the tags of near duplicates of the documents tagged recently (e.g.
+copies of the same story with a different headline)::
+
+    mytagger = extras.NearDuplicateTagger(myreader, mystemmer, myrater)
+
+Running a long-lived tagging service (see server.py for the options)::
+
+    $ ./server.py -p 8000 -d data/dict.pkl -j 4
+    $ curl -d '{"text": "...", "tags": 3}' localhost:8000/
+
 Running the module as a script::
 
     $ ./tagger.py <text document(s) to tag>
 
+Tagging a stream of documents in parallel, with one line of JSON for each
+one (the paths of the documents, or JSON objects like {"id": 1, "text":
+"..."}, are read from the standard input)::
+
+    $ find corpus/ -type f | ./tagger.py -i -j 4 -n 3 > tags.jsonl
+
 Example::
 
     $ ./tagger.py tests/*
@@ -83,13 +123,22 @@ Example::
 '''
 
 import collections
+import functools
+import heapq
 import re
+import time
+import types
 
 
-class Tag:
+class Tag(object):
     '''
     General class for tags (small units of text)
     '''
+
+    # documents are turned into one tag per word (and many more multitags),
+    # so instances don't carry a __dict__ (subclasses may add attributes
+    # freely, unless they define __slots__ too)
+    __slots__ = ('string', 'stem', 'rating', 'proper', 'terminal')
     
     def __init__(self, string, stem=None, rating=1.0, proper=False,
                  terminal=False):
@@ -124,11 +173,27 @@ class Tag:
     def __hash__(self):
         return hash(self.stem)
 
+    def __getstate__(self):
+        # without a __dict__, pickle protocols 0 and 1 need the values of the
+        # slots (those of subclasses too) to be given explicitly
+        state = dict(getattr(self, '__dict__', {}))
+        for cls in type(self).__mro__:
+            for name in cls.__dict__.get('__slots__', ()):
+                if hasattr(self, name):
+                    state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.iteritems():
+            setattr(self, name, value)
+
 
 class MultiTag(Tag):
     '''
     Class for aggregates of tags (usually next to each other in the document)
     '''
+
+    __slots__ = ('size', 'subratings', 'head', 'suffix')
     
     def __init__(self, tail, head=None):
         '''
@@ -138,6 +203,11 @@ class MultiTag(Tag):
         @returns: a new L{MultiTag} object
         '''
         
+        # the multitag without the last unit tag (head) and the one without
+        # the first (suffix, linked by L{Rater.create_multitags})
+        self.head = head
+        self.suffix = None
+
         if not head:
             Tag.__init__(self, tail.string, tail.stem, tail.rating,
                          tail.proper, tail.terminal)
@@ -180,6 +250,21 @@ class MultiTag(Tag):
             
         return product ** (1.0 / root)
 
+    def subtags(self):
+        '''
+        @returns: an iterator over the multitags formed by contiguous unit
+                  subtags of this one (excluding itself)
+        '''
+
+        # every span is a prefix (head) of a suffix of the multitag
+        start = self
+        while start:
+            t = start.head if start is self else start
+            while t:
+                yield t
+                t = t.head
+            start = start.suffix
+
     
 class Reader:
     '''
@@ -194,6 +279,28 @@ class Reader:
     match_paragraphs = re.compile('[\.\?!\t\n\r\f\v]+')
     match_phrases = re.compile('[,;:\(\)\[\]\{\}<>]+')
     match_words = re.compile('[\w\-\'_/&]+')
+
+    single_pass = False
+
+    def __init__(self, single_pass=False):
+        '''
+        @param single_pass: whether the text should be tokenized by a single
+                            scan (see L{scan}) instead of being split into
+                            paragraphs and phrases first (the tags are the
+                            same)
+
+        @returns: a new L{Reader} object
+        '''
+
+        self.single_pass = single_pass
+        if single_pass:
+            # each word together with the text up to the next one
+            self.match_tokens = re.compile('(?s)(%s)((?:(?!%s).)*)' % (
+                self.match_words.pattern, self.match_words.pattern))
+            # the last break in such text (the first group is set if it
+            # ends a paragraph, otherwise it ends a phrase)
+            self.match_breaks = re.compile('(?s).*(?:(%s)|%s)' % (
+                self.match_paragraphs.pattern, self.match_phrases.pattern))
     
     def __call__(self, text):
         '''
@@ -202,11 +309,101 @@ class Reader:
         @returns: a list of tags respecting the order in the text
         '''
 
-        text = self.preprocess(text)
+        return self.read(self.preprocess(text))
+
+    def read(self, text):
+        '''
+        @param text: a (preprocessed) string of text
+
+        @returns: a list of tags respecting the order in the text
+        '''
+
+        if self.single_pass:
+            return self.scan(text)
 
         # split by full stops, newlines, question marks...
         paragraphs = self.match_paragraphs.split(text)
 
+        return self.read_paragraphs(paragraphs)
+
+    def stream(self, source, chunk_size=65536):
+        '''
+        @param source:     a file object or an iterable of strings whose
+                           concatenation is the text to be tagged
+        @param chunk_size: number of characters read at a time from a file
+                           object
+
+        @returns: an iterator over the tags, respecting the order in the text
+        '''
+
+        if hasattr(source, 'read'):
+            source = iter(functools.partial(source.read, chunk_size), '')
+
+        rest = ''
+        for chunk in source:
+            text = rest + chunk
+            # only the paragraphs followed by a break are complete (the rest
+            # contains no breaks, so there is no need to scan it again)
+            end = 0
+            for match in self.match_paragraphs.finditer(text, len(rest)):
+                end = match.end()
+            if end == 0:
+                rest = text
+                continue
+            rest = text[end:]
+            for tag in self.read(self.preprocess(text[:end])):
+                yield tag
+
+        for tag in self.read(self.preprocess(rest)):
+            yield tag
+
+    def scan(self, text):
+        '''
+        @param text: a (preprocessed) string of text
+
+        @returns: a list of tags respecting the order in the text, found
+                  with a single pass over the text
+        '''
+
+        tags = []
+        append = tags.append
+
+        first = self.match_words.search(text)
+        if not first:
+            return tags
+
+        # the first word of a paragraph is never regarded as proper, unless
+        # it follows other punctuation (i.e. it is not in the first phrase)
+        match = self.match_breaks.match(text, 0, first.start())
+        proper = bool(match) and not match.group(1)
+
+        # words are usually separated by a single space, which is not worth
+        # matching every time
+        space = ' ' if not self.match_breaks.match(' ') else None
+
+        for word, gap in self.match_tokens.findall(text, first.start()):
+            tag = Tag(word.lower(), None, 1.0, proper and word[0].isupper())
+            append(tag)
+            match = gap != space and self.match_breaks.match(gap)
+            if match:
+                tag.terminal = True
+                proper = not match.group(1)
+            else:
+                proper = True
+
+        # the text ends the last phrase
+        if tags:
+            tags[-1].terminal = True
+
+        return tags
+
+    def read_paragraphs(self, paragraphs):
+        '''
+        @param paragraphs: a list of (preprocessed) paragraphs of text
+
+        @returns: a list of tags respecting the order in the text
+        '''
+
         tags = []
 
         for par in paragraphs:
@@ -262,10 +459,14 @@ class Stemmer:
 
     match_contractions = re.compile('(\w+)\'(m|re|d|ve|s|ll|t)?')
 
-    def __init__(self, stemmer=None):
+    def __init__(self, stemmer=None, cache_size=0):
         '''
-        @param stemmer: an object or module with a 'stem' method (defaults to
-                        stemming.porter2)
+        @param stemmer:    an object or module with a 'stem' method (defaults
+                           to stemming.porter2)
+        @param cache_size: maximum number of stems to remember across calls
+                           (the least recently used ones are forgotten
+                           first; 0 disables the cache, None makes it
+                           unbounded)
 
         @returns: a new L{Stemmer} object
         '''
@@ -274,6 +475,10 @@ class Stemmer:
             from stemming import porter2
             stemmer = porter2
         self.stemmer = stemmer
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
 
     def __call__(self, tag):
         '''
@@ -282,9 +487,41 @@ class Stemmer:
         @returns: the stemmed tag
         '''
 
-        string = self.preprocess(tag.string)
-        tag.stem = self.stemmer.stem(string)
-        return tag    
+        if self.cache_size == 0:
+            tag.stem = self.stemmer.stem(self.preprocess(tag.string))
+            return tag
+
+        try:
+            stem = self.cache.pop(tag.string)
+            self.hits += 1
+        except KeyError:
+            stem = self.stemmer.stem(self.preprocess(tag.string))
+            self.misses += 1
+            if self.cache_size and len(self.cache) >= self.cache_size:
+                self.cache.popitem(last=False)
+        # (re)insert the stem as the most recently used one
+        self.cache[tag.string] = stem
+        tag.stem = stem
+        return tag
+
+    def cache_info(self):
+        '''
+        @returns: a dictionary with the hits, misses and current size of the
+                  stem cache
+        '''
+
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self.cache), 'max_size': self.cache_size}
+
+    def clear_cache(self):
+        '''
+        Forget all the cached stems and reset the counters (e.g. to cache
+        stems only within a single document)
+        '''
+
+        self.cache.clear()
+        self.hits = 0
+        self.misses = 0
         
     def preprocess(self, string):
         '''
@@ -308,28 +545,51 @@ class Rater:
     tries to discard redundant tags)
     '''
 
-    def __init__(self, weights, multitag_size=3):
+    # whether __call__ takes the number of tags, for each class (see L{top})
+    takes_tags_number = {}
+
+    def __init__(self, weights, multitag_size=3, collector=None,
+                 spans=False):
         '''
         @param weights:       a dictionary of weights normalized in the
                               interval [0,1]
         @param multitag_size: maximum size of tags formed by multiple unit
                               tags
+        @param collector:     an optional L{Collector} object recording the
+                              time spent in each stage of the rating
+        @param spans:         whether multitags should be handled as spans
+                              of the list of tags (see L{span_call}), giving
+                              the same results with far fewer objects
 
         @returns: a new L{Rater} object
         '''
         
         self.weights = weights
         self.multitag_size = multitag_size
+        self.collector = collector
+        self.spans = spans
         
-    def __call__(self, tags):
+    def __call__(self, tags, tags_number=None):
         '''
-        @param tags: a list of (preferably stemmed) tags
+        @param tags:        a list of (preferably stemmed) tags
+        @param tags_number: number of best tags to be returned (all of them
+                            if None)
 
         @returns: a list of unique (multi)tags sorted by relevance
         '''
 
+        if self.spans:
+            return self.span_call(tags, tags_number)
+
+        collector = self.collector
+        start = collector and time.time()
+
         self.rate_tags(tags)
+        if collector: start = collector.lap('rate_tags', start)
         multitags = self.create_multitags(tags)
+        if collector:
+            start = collector.lap('create_multitags', start)
+            collector.count('multitags', len(multitags))
 
         # keep most frequent version of each tag
         clusters = collections.defaultdict(collections.Counter)
@@ -345,28 +605,190 @@ class Rater:
         term_count = collections.Counter(multitags)
                 
         for t, cnt in term_count.iteritems():
-            t.string = clusters[t].most_common(1)[0][0]
+            # the string is needed now only to discard one-character tags,
+            # otherwise just for the tags that are returned
+            if tags_number is None or t.size == 1:
+                t.string = clusters[t].most_common(1)[0][0]
             proper_freq = proper[t] / float(cnt)
             if proper_freq >= 0.5:
                 t.proper = True
                 t.rating = ratings[t]
         
+        if collector:
+            start = collector.lap('clusters', start)
+            collector.count('candidates', len(term_count))
+
         # purge duplicates and one-character tags
         unique_tags = set(t for t in term_count if len(t.string) > 1)
         # remove redundant tags
         for t, cnt in term_count.iteritems():
-            words = t.stem.split()
-            for l in xrange(1, len(words)):
-                for i in xrange(len(words) - l + 1):
-                    s = Tag(' '.join(words[i:i + l]))
-                    relative_freq = float(cnt) / term_count[s]
-                    if ((relative_freq == 1.0 and t.proper) or
-                        (relative_freq >= 0.5 and t.rating > 0.0)):
-                        unique_tags.discard(s)
-                    else:
-                        unique_tags.discard(t)
+            for s in t.subtags():
+                relative_freq = float(cnt) / term_count[s]
+                if ((relative_freq == 1.0 and t.proper) or
+                    (relative_freq >= 0.5 and t.rating > 0.0)):
+                    unique_tags.discard(s)
+                else:
+                    unique_tags.discard(t)
+        if collector: start = collector.lap('redundancy', start)
         
-        return sorted(unique_tags)
+        unique_tags = self.select(unique_tags, tags_number)
+        if tags_number is not None:
+            for t in unique_tags:
+                t.string = clusters[t].most_common(1)[0][0]
+        if collector: collector.lap('sort', start)
+        return unique_tags
+
+    def span_call(self, tags, tags_number=None):
+        '''
+        Same as L{__call__}, but each multitag is just a span of the list of
+        tags (see L{multitag_spans}), identified by the stems it covers;
+        strings and L{MultiTag} objects are built only for the tags that are
+        returned
+
+        (overriding L{create_multitags} or L{MultiTag.combined_rating} has no
+        effect here)
+
+        @param tags:        a list of (preferably stemmed) tags
+        @param tags_number: number of best tags to be returned (all of them
+                            if None)
+
+        @returns: a list of unique (multi)tags sorted by relevance
+        '''
+
+        collector = self.collector
+        start = collector and time.time()
+
+        self.rate_tags(tags)
+        if collector: start = collector.lap('rate_tags', start)
+
+        stems = [t.stem for t in tags]
+        # occurrences of each multitag and the first of its spans
+        term_count = {}
+        first = {}
+        positions = {}
+        proper = collections.defaultdict(int)
+        proper_ratings = collections.defaultdict(float)
+
+        for span in self.multitag_spans(tags):
+            i, size, rating, is_proper = span
+            if size == 1:
+                stem = stems[i]
+            else:
+                stem = ' '.join(stems[i:i + size])
+            if stem in term_count:
+                term_count[stem] += 1
+                positions[stem].append(i)
+            else:
+                term_count[stem] = 1
+                first[stem] = span
+                positions[stem] = [i]
+            if is_proper:
+                proper[stem] += 1
+                proper_ratings[stem] = max(proper_ratings[stem], rating)
+
+        if collector:
+            start = collector.lap('create_multitags', start)
+            collector.count('multitags', sum(term_count.itervalues()))
+
+        def string(stem):
+            # keep most frequent version of each tag
+            size = first[stem][1]
+            cluster = collections.Counter(
+                ' '.join([t.string for t in tags[i:i + size]])
+                for i in positions[stem])
+            return cluster.most_common(1)[0][0]
+
+        ratings = {}
+        propers = {}
+        for stem, cnt in term_count.iteritems():
+            i, size, rating, is_proper = first[stem]
+            if proper[stem] / float(cnt) >= 0.5:
+                is_proper = True
+                rating = proper_ratings[stem]
+            ratings[stem] = rating
+            propers[stem] = is_proper
+
+        if collector:
+            start = collector.lap('clusters', start)
+            collector.count('candidates', len(term_count))
+
+        # purge duplicates and one-character tags (multitags have spaces)
+        unique_tags = set(stem for stem in term_count
+                          if first[stem][1] > 1 or len(string(stem)) > 1)
+        # remove redundant tags
+        for stem, cnt in term_count.iteritems():
+            i, size = first[stem][:2]
+            for j in xrange(i, i + size):
+                for k in xrange(j + 1, i + size + 1):
+                    if k - j == size:
+                        continue
+                    sub = ' '.join(stems[j:k])
+                    relative_freq = float(cnt) / term_count[sub]
+                    if ((relative_freq == 1.0 and propers[stem]) or
+                        (relative_freq >= 0.5 and ratings[stem] > 0.0)):
+                        unique_tags.discard(sub)
+                    else:
+                        unique_tags.discard(stem)
+        if collector: start = collector.lap('redundancy', start)
+
+        # same order as L{select}
+        key = lambda stem: -ratings[stem]
+        if tags_number is None:
+            best = sorted(unique_tags, key=key)
+        else:
+            best = heapq.nsmallest(tags_number, unique_tags, key=key)
+
+        result = []
+        for stem in best:
+            i, size = first[stem][:2]
+            t = MultiTag(tags[i])
+            for tail in tags[i + 1:i + size]:
+                t = MultiTag(tail, t)
+            t.string = string(stem)
+            t.proper = propers[stem]
+            t.rating = ratings[stem]
+            result.append(t)
+        if collector: collector.lap('sort', start)
+        return result
+
+    def top(self, tags, tags_number):
+        '''
+        @param tags:        a list of (preferably stemmed) tags
+        @param tags_number: number of best tags to be returned
+
+        @returns: a list of the best unique (multi)tags sorted by relevance
+
+        (the number of tags is passed on to L{__call__} only if it takes it,
+        so that subclasses overriding __call__(self, tags) keep working)
+        '''
+
+        cls = self.__class__
+        takes_tags_number = Rater.takes_tags_number.get(cls)
+        if takes_tags_number is None:
+            import inspect
+
+            spec = inspect.getargspec(cls.__call__)
+            takes_tags_number = len(spec.args) > 2 or bool(spec.varargs)
+            Rater.takes_tags_number[cls] = takes_tags_number
+
+        if takes_tags_number:
+            return self(tags, tags_number)[:tags_number]
+        return self(tags)[:tags_number]
+
+    def select(self, tags, tags_number=None):
+        '''
+        @param tags:        an iterable of rated tags
+        @param tags_number: number of best tags to be returned (all of them
+                            if None)
+
+        @returns: a list of the best tags sorted by relevance
+        '''
+
+        if tags_number is None:
+            return sorted(tags)
+        # partial selection, equivalent to sorted(tags)[:tags_number] (the
+        # key keeps ties in their original order, as sorting does)
+        return heapq.nsmallest(tags_number, tags, key=lambda t: -t.rating)
 
     def rate_tags(self, tags):
         '''
@@ -388,20 +810,310 @@ class Rater:
         '''
         
         multitags = []
+        previous = []
         
         for i in xrange(len(tags)):
             t = MultiTag(tags[i])
-            multitags.append(t)
+            row = [t]
             for j in xrange(1, self.multitag_size):
                 if t.terminal or i + j >= len(tags):
                     break
                 else:
                     t = MultiTag(tags[i + j], t)
-                    multitags.append(t)
+                    row.append(t)
+            # the multitags starting at this tag are the suffixes of the ones
+            # starting at the previous tag
+            for j in xrange(1, len(previous)):
+                previous[j].suffix = row[j - 1]
+            multitags.extend(row)
+            previous = row
 
         return multitags
+
+    def multitag_spans(self, tags):
+        '''
+        @param tags: a list of rated tags (respecting the order in the text)
+
+        @returns: an iterator over the multitags that L{create_multitags}
+                  would create, in the same order, as (start, size, rating,
+                  proper) tuples
+        '''
+
+        length = len(tags)
+
+        for i in xrange(length):
+            # the rating of each multitag starting at i is computed from the
+            # running products of the ratings (as L{MultiTag.combined_rating}
+            # would compute them)
+            product = nonzero_product = 1.0
+            nonzero = 0
+            proper = True
+            for j in xrange(i, min(i + self.multitag_size, length)):
+                t = tags[j]
+                product *= t.rating
+                if t.rating > 0.0:
+                    nonzero_product *= t.rating
+                    nonzero += 1
+                proper = proper and t.proper
+                size = j - i + 1
+
+                if size == 1:
+                    yield i, 1, t.rating, t.proper
+                elif product == 0.0 and proper:
+                    # proper nouns shouldn't be penalized by stopwords
+                    if nonzero:
+                        yield i, size, nonzero_product ** (1.0 / nonzero), True
+                    else:
+                        yield i, size, 0.0, True
+                else:
+                    yield i, size, product ** (1.0 / size), proper
+
+                if t.terminal:
+                    break
     
     
+class Collector:
+    '''
+    Class for collecting the time spent in each stage of the tagging process,
+    together with other counters (number of tokens, multitags...)
+
+    (the same object can be shared by a L{Tagger} and its L{Rater}; override
+    L{record} and L{count} to forward the measures somewhere else)
+    '''
+
+    def __init__(self):
+        '''
+        @returns: a new (empty) L{Collector} object
+        '''
+
+        self.times = collections.Counter()
+        self.calls = collections.Counter()
+        self.counters = collections.Counter()
+
+    def record(self, stage, seconds):
+        '''
+        @param stage:   the name of a stage
+        @param seconds: the time spent in it
+        '''
+
+        self.times[stage] += seconds
+        self.calls[stage] += 1
+
+    def lap(self, stage, start):
+        '''
+        @param stage: the name of a stage
+        @param start: the time when the stage started
+
+        @returns: the current time (i.e. the start of the next stage)
+        '''
+
+        now = time.time()
+        self.record(stage, now - start)
+        return now
+
+    def count(self, name, number=1):
+        '''
+        @param name:   the name of a counter
+        @param number: the amount to be added to it
+        '''
+
+        self.counters[name] += number
+
+    def update(self, other):
+        '''
+        @param other: a L{Collector} object whose measures should be added to
+                      these ones
+        '''
+
+        self.times.update(other.times)
+        self.calls.update(other.calls)
+        self.counters.update(other.counters)
+
+    def reset(self):
+        '''
+        @returns: a L{Collector} with the measures taken so far, which are
+                  then cleared from this one
+        '''
+
+        taken = Collector()
+        taken.update(self)
+        self.times.clear()
+        self.calls.clear()
+        self.counters.clear()
+        return taken
+
+    def report(self):
+        '''
+        @returns: a dictionary with the total time and number of calls of
+                  each stage, and the counters
+        '''
+
+        stages = dict((stage, {'seconds': self.times[stage],
+                               'calls': self.calls[stage]})
+                      for stage in self.times)
+        return {'stages': stages, 'counters': dict(self.counters)}
+
+
+class ResultCache:
+    '''
+    Class for remembering the tags of documents, indexed by a hash of their
+    (normalized) text and of the configuration of the tagger
+
+    (recently used results are kept in memory, and all of them can be saved
+    to a directory too, e.g. to be shared by different processes)
+    '''
+
+    match_spaces = re.compile(' +')
+
+    def __init__(self, max_size=1024, directory=None, version=''):
+        '''
+        @param max_size:  maximum number of results kept in memory (the least
+                          recently used ones are forgotten first; 0 keeps
+                          them only in the directory, if any)
+        @param directory: an optional directory where all the results are
+                          saved
+        @param version:   a string identifying the dictionary (and anything
+                          else affecting the tags that the tagger doesn't
+                          know about, i.e. anything but the classes of its
+                          components, the stemmer wrapped by a L{Stemmer},
+                          the size of multitags and the settings of the
+                          reader), so that a new one invalidates the results
+
+        @returns: a new L{ResultCache} object
+        '''
+
+        self.max_size = max_size
+        self.directory = directory
+        self.version = version
+        self.memory = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, text, tags_number, tagger):
+        '''
+        @param text:        the text to be tagged
+        @param tags_number: number of best tags to be returned
+        @param tagger:      the L{Tagger} object tagging the text
+
+        @returns: the key of the tags of the text
+        '''
+
+        import hashlib
+
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        # runs of spaces and surrounding whitespace don't affect the tags
+        text = self.match_spaces.sub(' ', text.strip())
+
+        reader = tagger.reader
+        config = (self.version, tags_number,
+                  getattr(tagger.rater, 'multitag_size', None),
+                  self.name(reader),
+                  # settings of the readers changing what they read
+                  getattr(reader, 'incremental', None),
+                  getattr(reader, 'encoding', None),
+                  self.name(tagger.stemmer),
+                  self.name(getattr(tagger.stemmer, 'stemmer', None)),
+                  self.name(tagger.rater))
+        return hashlib.sha1(repr(config) + '\0' + text).hexdigest()
+
+    def name(self, component):
+        '''
+        @param component: a module, or any other object
+
+        @returns: the full name of the module, or of the class of the object
+        '''
+
+        if isinstance(component, types.ModuleType):
+            return component.__name__
+        cls = component.__class__
+        return cls.__module__ + '.' + cls.__name__
+
+    def get(self, key):
+        '''
+        @param key: the key of a result
+
+        @returns: (a copy of) the tags stored with the key, or None
+        '''
+
+        tags = self.memory.pop(key, None)
+        if tags is None and self.directory:
+            tags = self.load(key)
+        if tags is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.remember(key, tags)
+        return map(self.copy, tags)
+
+    def put(self, key, tags):
+        '''
+        @param key:  the key of a result
+        @param tags: the tags to be stored
+        '''
+
+        tags = map(self.copy, tags)
+        self.remember(key, tags)
+        if self.directory:
+            self.save(key, tags)
+
+    def copy(self, tag):
+        '''
+        @param tag: a L{Tag} (or L{MultiTag}) object
+
+        @returns: a copy of the tag, of the same class (multitags lose the
+                  links to their subtags, which are not needed any more)
+        '''
+
+        import copy
+
+        tag = copy.copy(tag)
+        if isinstance(tag, MultiTag):
+            tag.head = tag.suffix = None
+        return tag
+
+    def remember(self, key, tags):
+        self.memory.pop(key, None)
+        if len(self.memory) >= self.max_size:
+            if not self.memory:
+                return  # nothing is kept in memory
+            self.memory.popitem(last=False)
+        self.memory[key] = tags
+
+    def path(self, key):
+        import os
+
+        return os.path.join(self.directory, key[:2], key[2:])
+
+    def load(self, key):
+        import pickle
+
+        try:
+            with open(self.path(key), 'rb') as f:
+                return pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def save(self, key, tags):
+        import os
+        import pickle
+        import tempfile
+
+        path = self.path(key)
+        if not os.path.isdir(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                pass  # created meanwhile by another process
+        # write to a temporary file first, so that readers never see a
+        # partial result
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(tags, f, -1)
+        os.rename(temp, path)
+
+
 class Tagger:
     '''
     Master class for tagging text documents
@@ -410,11 +1122,16 @@ class Tagger:
     by using different classes as building blocks)
     '''
 
-    def __init__(self, reader, stemmer, rater):
+    def __init__(self, reader, stemmer, rater, collector=None, cache=None):
         '''
         @param reader: a L{Reader} object
         @param stemmer: a L{Stemmer} object
         @param rater: a L{Rater} object
+        @param collector: an optional L{Collector} object recording the time
+                          spent in each stage (pass the same one to the
+                          rater for more detail)
+        @param cache: an optional L{ResultCache} object remembering the tags
+                      of the documents already seen
 
         @returns: a new L{Tagger} object
         '''
@@ -422,6 +1139,8 @@ class Tagger:
         self.reader = reader
         self.stemmer = stemmer
         self.rater = rater
+        self.collector = collector
+        self.cache = cache
 
     def __call__(self, text, tags_number=5):
         '''
@@ -431,33 +1150,246 @@ class Tagger:
         Returns: a list of (hopefully) relevant tags
         ''' 
 
+        if self.cache is not None:
+            key = self.cache.key(text, tags_number, self)
+            tags = self.cache.get(key)
+            if tags is not None:
+                if self.collector: self.collector.count('result_cache_hits')
+                return tags
+
+        if self.collector:
+            tags = self.instrumented_call(text, tags_number)
+        else:
+            tags = self.reader(text)
+            tags = map(self.stemmer, tags)
+            tags = self.rater.top(tags, tags_number)
+
+        if self.cache is not None:
+            self.cache.put(key, tags)
+        return tags
+
+    def instrumented_call(self, text, tags_number=5):
+        '''
+        Same as L{__call__}, recording the measures in the collector
+        '''
+
+        collector = self.collector
+        hits = getattr(self.stemmer, 'hits', 0)
+        misses = getattr(self.stemmer, 'misses', 0)
+        start = time.time()
+
         tags = self.reader(text)
+        start = collector.lap('reader', start)
         tags = map(self.stemmer, tags)
-        tags = self.rater(tags)
+        start = collector.lap('stemmer', start)
+        collector.count('documents')
+        collector.count('tokens', len(tags))
+        collector.count('stem_cache_hits',
+                        getattr(self.stemmer, 'hits', 0) - hits)
+        collector.count('stem_cache_misses',
+                        getattr(self.stemmer, 'misses', 0) - misses)
+        tags = self.rater.top(tags, tags_number)
+        collector.lap('rater', start)
+
+        return tags
+
+    def tag_stream(self, source, tags_number=5):
+        '''
+        @param source:      a file object or an iterable of chunks of text to
+                            be tagged (see L{Reader.stream})
+        @param tags_number: number of best tags to be returned
+
+        @returns: a list of (hopefully) relevant tags
+        '''
 
-        return tags[:tags_number]
+        tags = map(self.stemmer, self.reader.stream(source))
+
+        return self.rater.top(tags, tags_number)
+
+    def tag_many(self, documents, tags_number=5, workers=None, chunksize=8,
+                 pool=None):
+        '''
+        @param documents:   an iterable of strings of text to be tagged
+        @param tags_number: number of best tags to be returned for each
+                            document
+        @param workers:     number of worker processes (defaults to the
+                            number of CPUs; 1 tags the documents in the
+                            current process)
+        @param chunksize:   number of documents sent to a worker at a time
+        @param pool:        a pool returned by L{create_pool} to be used
+                            instead of starting a new one
+
+        @returns: a list with the tags of each document, in input order
+        '''
+
+        return list(self.tag_iter(documents, tags_number, workers, chunksize,
+                                  pool))
+
+    def tag_iter(self, documents, tags_number=5, workers=None, chunksize=8,
+                 pool=None):
+        '''
+        Same as L{tag_many}, but the documents are consumed lazily and the
+        tags of each one are yielded (in input order) as soon as they are
+        ready, so that arbitrarily long streams can be tagged
+
+        @returns: an iterator over the tags of each document
+        '''
+
+        if pool is not None:
+            jobs = ((text, tags_number) for text in documents)
+            for tags, measures in pool.imap(_tag_document, jobs, chunksize):
+                if measures and self.collector:
+                    self.collector.update(measures)
+                yield tags
+            return
+
+        import multiprocessing
+
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        if workers <= 1:
+            for text in documents:
+                yield self(text, tags_number)
+            return
+
+        pool = self.create_pool(workers)
+        try:
+            for tags in self.tag_iter(documents, tags_number,
+                                      chunksize=chunksize, pool=pool):
+                yield tags
+        finally:
+            pool.close()
+            pool.join()
+
+    def create_pool(self, workers=None):
+        '''
+        @param workers: number of worker processes (defaults to the number of
+                        CPUs)
+
+        @returns: a multiprocessing pool whose workers tag documents with a
+                  copy of this tagger (to be passed to L{tag_many} and
+                  closed by the caller)
+        '''
+
+        import multiprocessing
+
+        # each worker receives its own copy of the tagger (and therefore of
+        # the dictionary) only once, when the pool is started
+        return multiprocessing.Pool(workers, _init_worker, (self,))
+
+_worker_tagger = None
+
+
+def _init_worker(tagger):
+    global _worker_tagger
+    _worker_tagger = tagger
+    # the copy of the collector still has the measures taken in the parent,
+    # which must not be sent back again
+    if tagger.collector:
+        tagger.collector.reset()
+
+
+def _tag_document(job):
+    text, tags_number = job
+    tags = _worker_tagger(text, tags_number)
+    # send back the measures taken in the worker, if any
+    measures = _worker_tagger.collector and _worker_tagger.collector.reset()
+    return tags, measures
+
+
+def _read_documents(lines):
+    # each line is either the path of a document or a JSON object with its
+    # text and an optional id; the tags are then written along with the path
+    # or the id (and an error, if the document couldn't be read)
+    import json
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+
+        if line.startswith('{'):
+            try:
+                document = json.loads(line)
+                record = {'id': document.get('id')}
+                text = document['text'].encode('utf-8')
+            except (ValueError, KeyError, TypeError, AttributeError):
+                yield {'error': 'malformed document'}, ''
+                continue
+        else:
+            record = {'path': line}
+            try:
+                with open(line, 'r') as f:
+                    text = f.read()
+            except IOError as e:
+                record['error'] = str(e)
+                text = ''
+
+        yield record, text
 
 
 
 if __name__ == '__main__':
 
+    import getopt
     import glob
     import pickle
     import sys
 
-    if len(sys.argv) < 2:
+    # -s prints the time spent in each stage at the end
+    # -i reads the paths of the documents (or JSON objects like {"id": 1,
+    #    "text": "..."}) from the standard input, one per line, and writes the
+    #    tags of each one as a line of JSON, in the same order
+    # -j number of worker processes for -i (defaults to the number of CPUs)
+    # -n number of tags for each document (defaults to 5)
+    options, documents = getopt.getopt(sys.argv[1:], 'sij:n:')
+    options = dict(options)
+    collector = Collector() if '-s' in options else None
+    tags_number = int(options.get('-n', 5))
+
+    if '-i' in options:
+        import json
+
+        weights = pickle.load(open('data/dict.pkl', 'rb'))
+        tagger = Tagger(Reader(), Stemmer(),
+                        Rater(weights, collector=collector), collector)
+        workers = int(options['-j']) if '-j' in options else None
+
+        # the documents are read by a thread of the pool, which queues
+        # their records before they are tagged (tee is not thread-safe)
+        records = collections.deque()
+
+        def read_texts():
+            for record, text in _read_documents(sys.stdin):
+                records.append(record)
+                yield text
+
+        for tags in tagger.tag_iter(read_texts(), tags_number, workers):
+            record = records.popleft()
+            record['tags'] = [{'tag': t.string.decode('utf-8', 'replace'),
+                               'rating': t.rating} for t in tags]
+            sys.stdout.write(json.dumps(record) + '\n')
+
+        if collector:
+            sys.stderr.write(json.dumps(collector.report(), indent=4,
+                                        sort_keys=True) + '\n')
+        sys.exit(0)
+
+    if not documents:
         print 'No arguments given, running tests: '
         documents = glob.glob('tests/*')
-    else:
-        documents = sys.argv[1:]
     
     print 'Loading dictionary... '
     weights = pickle.load(open('data/dict.pkl', 'rb'))
 
-    tagger = Tagger(Reader(), Stemmer(), Rater(weights))
+    tagger = Tagger(Reader(), Stemmer(), Rater(weights, collector=collector),
+                    collector)
 
     for doc in documents:
         with open(doc, 'r') as file:
             print 'Tags for ', doc, ':'
-            print tagger(file.read())
-          
+            print tagger(file.read(), tags_number)
+
+    if collector:
+        import json
+        print json.dumps(collector.report(), indent=4, sort_keys=True)